@@ -54,9 +54,95 @@ THE SOFTWARE.
 """
 
 # standard library
-import colorsys    # colour format conversions
-from math import log, exp, floor, pi
+import argparse
+import asyncio
+import contextlib
+import functools
+from math import ceil, log, exp, isfinite, pi
+import numbers     # for seed type checks
 import random      # for jitter values
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, namedtuple
+from itertools import chain, count, islice, product, tee
+from multiprocessing import shared_memory
+
+# Optional dependencies
+try:
+    import numpy as np    # for vectorised palette generation
+except ImportError:
+    np = None
+
+
+# Instrumentation: while metrics are enabled (see enable_metrics()), calls
+# of the functions and methods decorated with _instrumented() are timed
+# and recorded in _metrics. Otherwise, the only cost is a check of
+# _metrics on each call.
+_metrics = None
+
+
+def _instrumented(k_arg="k", lazy=False):
+    """ Decorator recording calls of a function in the enabled Metrics
+
+        Arguments:
+
+        o k_arg - name of the argument giving the number of colours; if
+                  it is not an integer, its length is used instead
+
+        o lazy - True for functions returning iterators, whose time is
+                 measured as they are consumed, and recorded when they are
+                 exhausted or closed
+    """
+    def decorate(func):
+        name = func.__qualname__
+        code = func.__code__
+        position = code.co_varnames[:code.co_argcount].index(k_arg)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = _metrics
+            if metrics is None:
+                return func(*args, **kwargs)
+            k = args[position] if len(args) > position else kwargs.get(k_arg)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            if lazy:
+                return _timed_iter(metrics, name, k, result, elapsed)
+            metrics.record(name, k, elapsed)
+            return result
+        return wrapper
+    return decorate
+
+
+def _timed_iter(metrics, name, k, iterator, elapsed):
+    """ Generator passing on the items of iterator, then recording the time
+        spent in it, plus elapsed, as a call of name
+    """
+    perf_counter = time.perf_counter
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += perf_counter() - start
+            yield item
+    finally:
+        metrics.record(name, k, elapsed)
 
 
 class ColorSpiral(object):
@@ -80,10 +166,21 @@ class ColorSpiral(object):
 
        A brightness 'jitter' may also be provided as an absolute value in
        V-space, to aid in distinguishing consecutive colour points on the
-       path.
+       path. Jitter is drawn from a random stream owned by each ColorSpiral
+       object; if an integer seed is given, the jitter for the nth colour
+       depends only on the seed and n, so palettes are reproducible, and
+       the same whether they are generated in one piece or in chunks.
+
+       ColorSpiral objects are mutable, and compare by identity; a
+       SpiralSpec holds the same parameters as an immutable value. They
+       have fixed slots, so other attributes cannot be added to them, but
+       they may be weakly referenced.
     """
+    __slots__ = ("_a", "_b", "_v_init", "_v_final", "_jitter", "_seed",
+                 "_seed_key", "_rng", "_lut", "__weakref__")
+
     def __init__(self, a=1, b=0.33, v_init=0.85, v_final=0.5,
-                 jitter=0.05):
+                 jitter=0.05, seed=None):
         """Initialise a logarithmic spiral path through HSV colour space
 
            Arguments:
@@ -104,20 +201,49 @@ class ColorSpiral(object):
                       selected colour. The amount of jitter will be selected
                       from a uniform random distribution [-jitter, jitter],
                       and V will be maintained in [0,1].
+
+           o seed - source of jitter values. If None (the default), jitter
+                    is drawn from a private, randomly-seeded stream. If an
+                    integer, jitter is a deterministic function of the seed
+                    and the index of each colour. Alternatively, an object
+                    with a random() method, such as random.Random, may be
+                    given: get_colors() draws jitter from it in turn, and
+                    the array methods draw one value from it to seed the
+                    jitter of each block of colours. Other seeds raise
+                    TypeError.
         """
         # Initialise attributes
-        self._a = None
+        self._lut = None
         self.a = a
-        self._b = None
         self.b = b
-        self._v_init = None
         self.v_init = v_init
-        self._v_final = None
         self.v_final = v_final
-        self._jitter = None
         self.jitter = jitter
+        self.seed = seed
 
-    def get_colors(self, k, offset=0.1):
+    @classmethod
+    def from_spec(cls, spec):
+        """ Return a ColorSpiral with the parameters of a SpiralSpec, which
+            have already been checked, and so are not clamped again.
+        """
+        cspiral = cls.__new__(cls)
+        (cspiral._a, cspiral._b, cspiral._v_init, cspiral._v_final,
+         cspiral._jitter, seed) = spec
+        cspiral.seed = seed
+        cspiral._lut = None
+        return cspiral
+
+    @property
+    def spec(self):
+        """ The parameters of the spiral, as a SpiralSpec. Its seed is None
+            if jitter is drawn from a random stream rather than determined
+            by an integer seed.
+        """
+        return SpiralSpec(self._a, self._b, self._v_init, self._v_final,
+                          self._jitter, self._seed)
+
+    @_instrumented(lazy=True)
+    def get_colors(self, k, offset=0.1, fmt="float"):
         """ A generator returning the RGB colour space values for k
             evenly-spaced points along the defined spiral in HSV space.
 
@@ -126,39 +252,598 @@ class ColorSpiral(object):
             o k - the number of points to return
 
             o offset - how far along the spiral path to start.
+
+            o fmt - output format: "float" for tuples of RGB values in
+                    [0, 1], "rgb8" for tuples of 8-bit integers, "packed"
+                    for 0xRRGGBB integers, or "hex" for '#rrggbb' strings.
+                    Channels are clamped to [0, 1] and rounded to nearest
+                    for the integer formats.
+        """
+        _check_format(fmt)
+        return _format_colors(self._iter_colors(range(1, k+1), k, offset),
+                              fmt)
+
+    def color_at(self, n, k, offset=0.1):
+        """ Return the RGB colour space value for the nth of k evenly-spaced
+            points along the defined spiral in HSV space.
+
+            This is the same as list(self.get_colors(k, offset))[n], but is
+            calculated directly, without generating the preceding colours.
+            Jitter matches get_colors() exactly when the ColorSpiral has an
+            integer seed.
+
+            Arguments:
+
+            o n - index of the point to return, in [0, k); negative values
+                  count back from the end of the spiral, as for lists
+
+            o k - the number of points on the spiral
+
+            o offset - how far along the spiral path to start.
+        """
+        try:
+            index = range(1, k+1)[n]
+        except IndexError:
+            raise IndexError("colour index %d out of range for k=%d" % (n, k))
+        return next(self._iter_colors((index,), k, offset))
+
+    def colors_range(self, start, stop, k, offset=0.1):
+        """ Return a list of the RGB colour space values for points start
+            to stop of k evenly-spaced points along the defined spiral.
+
+            This is the same as list(self.get_colors(k, offset))[start:stop],
+            but does not generate the colours before start. Jitter matches
+            get_colors() exactly when the ColorSpiral has an integer seed.
+
+            Arguments:
+
+            o start, stop - slice of the points to return, interpreted as
+                            for lists
+
+            o k - the number of points on the spiral
+
+            o offset - how far along the spiral path to start.
+        """
+        return list(self._iter_colors(range(1, k+1)[start:stop], k, offset))
+
+    @_instrumented()
+    def get_palette(self, k, offset=0.1, typecode='d'):
+        """ Return the RGB colour space values for k evenly-spaced points
+            along the defined spiral in HSV space, as a compact Palette.
+
+            If NumPy is available the palette is calculated as for
+            get_colors_array(), otherwise as for get_colors().
+
+            Arguments:
+
+            o k - the number of points to return
+
+            o offset - how far along the spiral path to start.
+
+            o typecode - 'd' or 'f' to hold colours as double or single
+                         precision floats, or 'B' for 8-bit integers
+        """
+        if typecode == 'B':
+            return self.get_palette(k, offset).to_rgb8()
+        if np is not None:
+            return Palette(self.get_colors_array(k, offset).astype(typecode),
+                           typecode)
+        return Palette.from_colors(self.get_colors(k, offset), typecode)
+
+    @_instrumented("codes")
+    def colors_for_codes(self, codes, k=None, offset=0.1, packed=False,
+                         na_color=(0.0, 0.0, 0.0)):
+        """ Return the colours for an array of integer category codes,
+            gathered from the palette of k colours in a single array
+            operation, rather than by looking each one up in a dictionary.
+            Requires NumPy.
+
+            Colour i of get_colors_array(k, offset) is assigned to code i.
+
+            Arguments:
+
+            o codes - array of integer codes in [0, k), or -1 for missing
+                      values. A pandas Categorical (or categorical Series)
+                      or pyarrow DictionaryArray may be given instead, in
+                      which case its codes and number of categories are
+                      used.
+
+            o k - the number of categories; by default, the number of
+                  categories of codes, or the largest code plus one
+
+            o offset - how far along the spiral path to start.
+
+            o packed - if True, return a uint32 array of 0xRRGGBB values,
+                       with channels rounded to 8-bit integers as for
+                       Palette.to_rgb8(), rather than an (n, 3) float array
+
+            o na_color - RGB colour for codes of -1
+        """
+        _require_numpy("colors_for_codes()")
+        codes, categories = _category_codes(codes)
+        if k is None:
+            k = categories
+        if k is None:
+            k = int(codes.max()) + 1 if codes.size else 0
+        if codes.size and (codes.max() >= k or codes.min() < -1):
+            raise IndexError("category codes must be in [-1, %d)" % k)
+        # Missing values (-1) index the final, na_color, row of the palette
+        palette = np.empty((k + 1, 3))
+        if k:
+            palette[:k] = self.get_colors_array(k, offset)
+        palette[k] = na_color
+        if packed:
+            return _pack_rgb8(_rgb8_array(palette))[codes]
+        return palette[codes]
+
+    @_instrumented(lazy=True)
+    def get_stable_colors(self, k, start=0, offset=0.1):
+        """ A generator returning the RGB colour space values for k points
+            along the defined spiral in HSV space, in an order that does not
+            depend on the total number of points.
+
+            Unlike get_colors(), where every colour changes when k changes,
+            colour n of this sequence is always the same, so that a palette
+            may be extended with more colours without recolouring the
+            existing ones. Points are placed along the spiral at successive
+            positions of the golden ratio sequence, frac(n * 0.618...), so
+            that each new point falls in the largest remaining gap.
+
+            Arguments:
+
+            o k - the number of points to return, or None to return points
+                  without limit
+
+            o start - index in the open-ended sequence of the first point
+                      to return
+
+            o offset - how far along the spiral path to start.
+        """
+        if k is None:
+            indices = count(start + 1)
+        else:
+            indices = range(start + 1, start + k + 1)
+        return self._iter_colors(indices, 1, offset, stable=True)
+
+    def color_for_key(self, key, buckets=1024, offset=0.1):
+        """ Return the RGB colour space value for key, chosen by a stable
+            hash of the key rather than its position in a set of keys.
+
+            The key is hashed (with BLAKE2b, so the hash does not vary
+            between processes, as Python's hash() does) into one of buckets
+            buckets by jump consistent hashing, and the bucket number used
+            as an index into the open-ended sequence of get_stable_colors().
+            Any process colours the same key the same way, without needing
+            to know the other keys. Keys in different buckets are spaced
+            along the spiral by the golden ratio sequence; keys in the same
+            bucket share a colour, so buckets should be several times the
+            expected number of keys. Increasing buckets moves only the keys
+            that move to the new buckets, and does not change the colours
+            of existing buckets.
+
+            Jitter is consistent between processes only if the ColorSpiral
+            has an integer seed.
+
+            Arguments:
+
+            o key - str, bytes or int key to colour. Other objects are
+                    hashed by their str() value.
+
+            o buckets - the number of distinct colours keys are mapped to
+
+            o offset - how far along the spiral path to start.
+        """
+        bucket = _jump_hash(_stable_hash(key), buckets)
+        return self.color_at_stable(bucket, offset)
+
+    def color_at_stable(self, n, offset=0.1):
+        """ Return the RGB colour space value for point n of the open-ended
+            sequence of get_stable_colors(), without generating the
+            preceding points.
+
+            Arguments:
+
+            o n - index of the point in the open-ended sequence
+
+            o offset - how far along the spiral path to start.
+        """
+        return next(self._iter_colors((n + 1,), 1, offset, stable=True))
+
+    def _iter_colors(self, indices, k, offset, stable=False):
+        """ Generator returning the RGB colour space values for the points
+            numbered by indices (in [1, k]) of k along the spiral.
+
+            If stable is True, indices number points of the open-ended
+            sequence used by get_stable_colors() instead, and k should be 1.
         """
         # We use the offset to skip a number of similar colours near to
         # HSV axis
-        assert offset > 0 and offset < 1, "offset must be in (0,1)"
+        self._check_spiral(k, offset)
+        if k == 0:
+            return
+        if self._lut is not None and self._lut.covers(offset):
+            yield from self._iter_lut_colors(indices, k, offset, stable)
+        else:
+            yield from self._iter_direct_colors(indices, k, offset, stable)
+
+    def _iter_direct_colors(self, indices, k, offset, stable):
+        """ Generator for _iter_colors(), calculating each colour directly
+        """
+        # Loop invariants are bound to local names, and the HSV to RGB
+        # conversion is done inline, to avoid attribute lookups and function
+        # calls for each point
+        two_pi = 2 * pi
+        inv_b = 1./self._b
+        k_offset = k * offset
+        log_scale = log((1 + offset) * k * self._a)
+        a, b = self._a, self._b
+        v_init = self._v_init
         v_rate = (self._v_final - self._v_init) / float(k)
+        jitter = self._jitter
+        jitter_2 = 2 * jitter
+        key = self._seed_key
+        uniform = None
+        if jitter:
+            indices, uniform = self._jitter_source(indices)
         # Generator for colours: we have divided the arc length into sections
         # of equal length, and step along them
-        for n in range(1, k+1):
+        for n in indices:
+            # x is the position of the point along the spiral, in [0, k]
+            x = (n * _GOLDEN) % 1.0 if stable else n
+            x_offset = x + k_offset
             # For each value of n, t indicates the angle through which the
             # spiral has turned, to this point
-            t = (1./self._b) * (log(n + (k * offset)) -
-                                log((1 + offset) * k * self._a))
+            t = inv_b * (log(x_offset) - log_scale)
             # Put 0 <= h <= 2*pi, where h is the angular part of the polar
-            # co-ordinates for this point on the spiral
-            h = t
-            while h < 0:
-                h += 2 * pi
-            h = (h - (floor(h/(2 * pi)) * pi))
+            # co-ordinates for this point on the spiral. Negative angles are
+            # brought into [0, 2*pi) in a single step by the float modulus,
+            # so the cost does not depend on how far t is from zero. The %
+            # and // operators stand in for fmod() and floor() calls.
+            if t < 0:
+                h = t % two_pi
+            else:
+                h = t - (t // two_pi) * pi
             # Now put h in [0, 1] for colorsys conversion
-            h = h / (2 * pi)
-            # r is the radial distance of this point from the centre
-            r = self._a * exp(self._b * t)
+            h = h / two_pi
+            # r (used as s in HSV) is the radial distance of this point from
+            # the centre. We have arranged the arithmetic such that
+            # 0 <= r <= 1
+            r = a * exp(b * t)
             # v is the brightness of this point, linearly interpolated
             # from self._v_init to self._v_final. Jitter size is sampled from
-            # a uniform distribution
-            if self._jitter:
-                jitter = random.random() * 2 * self._jitter - self._jitter
+            # a uniform distribution. Even without jitter, rounding can take
+            # v just outside [0, 1], so it is always clamped
+            if not jitter:
+                v = v_init + x * v_rate
             else:
-                jitter = 0
-            v = self._v_init + (n * v_rate + jitter)
-            # We have arranged the arithmetic such that 0 <= r <= 1, so
-            # we can use this value directly as s in HSV
-            yield colorsys.hsv_to_rgb(h, r, max(0, min(v, 1)))
+                if uniform is not None:
+                    u = uniform()
+                else:
+                    # As _counter_uniform(key, n), inlined for speed
+                    z = (key + n * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+                    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & \
+                        0xFFFFFFFFFFFFFFFF
+                    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & \
+                        0xFFFFFFFFFFFFFFFF
+                    u = ((z ^ (z >> 31)) >> 11) * 1.1102230246251565e-16
+                v = v_init + (x * v_rate + (u * jitter_2 - jitter))
+            if v > 1:
+                v = 1.0
+            elif v < 0:
+                v = 0.0
+            # Convert from HSV to RGB, as colorsys.hsv_to_rgb()
+            h *= 6.0
+            i = h // 1.0
+            f = h - i
+            p = v * (1.0 - r)
+            q = v * (1.0 - r * f)
+            t = v * (1.0 - r * (1.0 - f))
+            i %= 6.0
+            if i == 0:
+                yield v, t, p
+            elif i == 1:
+                yield q, v, p
+            elif i == 2:
+                yield p, v, t
+            elif i == 3:
+                yield p, q, v
+            elif i == 4:
+                yield t, p, v
+            else:
+                yield v, p, q
+
+    def _iter_lut_colors(self, indices, k, offset, stable):
+        """ Generator for _iter_colors(), interpolating each colour from
+            the lookup table made by build_lut()
+        """
+        lut = self._lut
+        values, direct = lut.python_tables()
+        last = len(direct) - 1
+        # u = (x + k * offset) / ((1 + offset) * k) is the position of a
+        # point in the table, and pos its (fractional) table index
+        u_scale = 1. / ((1 + offset) * k)
+        u_base = k * offset * u_scale
+        pos_base = (u_base - lut.u_min) * lut.inv_du
+        pos_scale = u_scale * lut.inv_du
+        v_init = self._v_init
+        v_rate = (self._v_final - self._v_init) / float(k)
+        jitter = self._jitter
+        jitter_2 = 2 * jitter
+        key = self._seed_key
+        uniform = None
+        if jitter:
+            indices, uniform = self._jitter_source(indices)
+        for n in indices:
+            x = (n * _GOLDEN) % 1.0 if stable else n
+            pos = x * pos_scale + pos_base
+            i = int(pos)
+            if i > last:
+                i = last
+            if direct[i]:
+                if key is not None and uniform is not None:
+                    # Keep the seeded blocks in step with indices
+                    uniform()
+                yield next(self._iter_direct_colors((n,), k, offset, stable))
+                continue
+            f = pos - i
+            j = 6 * i
+            r, g, b, dr, dg, db = values[j:j + 6]
+            r += f * dr
+            g += f * dg
+            b += f * db
+            # v as in _iter_direct_colors()
+            if not jitter:
+                v = v_init + x * v_rate
+            else:
+                if uniform is not None:
+                    u = uniform()
+                else:
+                    z = (key + n * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+                    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & \
+                        0xFFFFFFFFFFFFFFFF
+                    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & \
+                        0xFFFFFFFFFFFFFFFF
+                    u = ((z ^ (z >> 31)) >> 11) * 1.1102230246251565e-16
+                v = v_init + (x * v_rate + (u * jitter_2 - jitter))
+            if v > 1:
+                v = 1.0
+            elif v < 0:
+                v = 0.0
+            yield v * r, v * g, v * b
+
+    def build_lut(self, tolerance=1e-4, offset=0.1, max_size=2 ** 22):
+        """ Build a lookup table of colours along the spiral, from which
+            get_colors(), get_colors_array() and the other colour methods
+            then interpolate colours for any k, rather than evaluating the
+            spiral for each one. Requires NumPy.
+
+            The table is made just large enough that interpolated colours
+            are within tolerance of the directly calculated ones, in each
+            RGB channel; V, including any jitter, is applied exactly. The
+            table depends only on a and b, and is discarded if either is
+            changed. It is not used by get_colors_array() with several
+            workers. Returns the number of entries in the table.
+
+            Arguments:
+
+            o tolerance - largest permitted error in any RGB value
+
+            o offset - the smallest offset that colours will be requested
+                       for; colours for smaller offsets are calculated
+                       directly
+
+            o max_size - the largest number of table entries permitted;
+                         ValueError is raised if the tolerance cannot be
+                         met within it
+        """
+        _require_numpy("build_lut()")
+        assert offset > 0 and offset < 1, "offset must be in (0,1)"
+        self._check_spiral(1, offset)
+        self._lut = _SpiralTable(self._a, self._b, tolerance, offset,
+                                 max_size)
+        return len(self._lut.flags)
+
+    def clear_lut(self):
+        """ Discard the lookup table made by build_lut(), so that colours
+            are again calculated directly
+        """
+        self._lut = None
+
+    @_instrumented()
+    def get_colors_array(self, k, offset=0.1, workers=1):
+        """ Return the RGB colour space values for k evenly-spaced points
+            along the defined spiral in HSV space, as a (k, 3) NumPy array.
+
+            This computes the same points as get_colors(), but evaluates
+            the whole spiral with array operations rather than a Python
+            loop, and so is much faster for large k. Requires NumPy.
+
+            With more than one worker, the points are divided into equal
+            ranges, which are calculated in a pool of processes and written
+            directly into shared memory. The result is identical to that
+            from a single worker, except that unseeded jitter is drawn from
+            a counter-based stream seeded from this object's stream.
+
+            Arguments:
+
+            o k - the number of points to return
+
+            o offset - how far along the spiral path to start.
+
+            o workers - the number of processes to use, or None for one per
+                        CPU
+        """
+        _require_numpy("get_colors_array()")
+        self._check_spiral(k, offset)
+        if k == 0:
+            return np.empty((0, 3))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and k > 1:
+            return self._colors_array_parallel(k, offset, workers)
+        return self._colors_array(np.arange(1, k + 1, dtype=float), k, offset)
+
+    @_instrumented(lazy=True)
+    def iter_color_chunks(self, k, chunk_size=65536, offset=0.1, out=None):
+        """ A generator returning the RGB colour space values for k
+            evenly-spaced points along the defined spiral in HSV space, as
+            (chunk_size, 3) NumPy arrays, the last of which may be shorter.
+            Requires NumPy.
+
+            The chunks together hold the same colours as get_colors_array(),
+            but only one chunk is calculated at a time, so memory use is
+            bounded by chunk_size rather than k.
+
+            Arguments:
+
+            o k - the number of points to return
+
+            o chunk_size - the number of points in each chunk
+
+            o offset - how far along the spiral path to start.
+
+            o out - a (chunk_size, 3) array to write each chunk into, in
+                    place of allocating a new array. The same array (or, for
+                    the last chunk, a leading slice of it) is returned every
+                    time, so each chunk must be used or copied before the
+                    next is requested.
+        """
+        _require_numpy("iter_color_chunks()")
+        self._check_spiral(k, offset)
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive, got %r" %
+                             chunk_size)
+        if out is not None and out.shape != (chunk_size, 3):
+            raise ValueError("out must have shape (%d, 3), got %r" %
+                             (chunk_size, out.shape))
+        return self._iter_chunks(k, chunk_size, offset, out)
+
+    def _iter_chunks(self, k, chunk_size, offset, out):
+        """ Generator of colour chunks for iter_color_chunks() """
+        n = np.arange(1, chunk_size + 1, dtype=float)
+        for start in range(0, k, chunk_size):
+            size = min(chunk_size, k - start)
+            if size < chunk_size:
+                n = n[:size]
+                out = None if out is None else out[:size]
+            yield self._colors_array(n, k, offset, out)
+            n += chunk_size
+
+    def _colors_array(self, n, k, offset, out=None):
+        """ Return a NumPy array of the RGB colour space values for the
+            points numbered by the NumPy array n (in [1, k]) of k along the
+            spiral, written into the (len(n), 3) array out if given.
+        """
+        if self._jitter:
+            jitter = self._jitter_array(n) * 2 * self._jitter - self._jitter
+        else:
+            jitter = 0
+        if self._lut is not None and self._lut.covers(offset):
+            rgb, direct = self._lut.interpolate(
+                (n + k * offset) / ((1 + offset) * k))
+            v_rate = (self._v_final - self._v_init) / float(k)
+            v = np.clip(self._v_init + (n * v_rate + jitter), 0, 1)
+            rgb = np.multiply(rgb, v[:, None], out=out)
+            if direct.any():
+                # Across hue jumps, as calculated without the table
+                rgb[direct] = _spiral_rgb_array(
+                    n[direct], k, offset, self._a, self._b, self._v_init,
+                    self._v_final, jitter[direct] if self._jitter else 0)
+            return rgb
+        return _spiral_rgb_array(n, k, offset, self._a, self._b,
+                                 self._v_init, self._v_final, jitter, out)
+
+    def _colors_array_parallel(self, k, offset, workers):
+        """ Return get_colors_array(k, offset), calculated in parallel by
+            workers processes writing into shared memory.
+        """
+        spec = self.spec
+        if self._jitter and self._seed is None:
+            # Workers cannot share this object's stream, so all draw from
+            # the same counter-based stream instead, seeded with random(),
+            # the only method seed objects need to have
+            spec = spec._replace(seed=int(self._rng.random() * 2 ** 53))
+        bounds = [k * i // workers for i in range(workers + 1)]
+        shm = shared_memory.SharedMemory(create=True, size=k * 3 * 8)
+        try:
+            with ProcessPoolExecutor(workers) as pool:
+                jobs = [pool.submit(_fill_shared_colors, spec, shm.name,
+                                    k, offset, start, stop)
+                        for start, stop in zip(bounds, bounds[1:])
+                        if stop > start]
+                for job in jobs:
+                    job.result()
+            colors = np.ndarray((k, 3), buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return colors
+
+    def _jitter_source(self, indices):
+        """ Return indices, and a function of no arguments giving the
+            uniform [0, 1) jitter sample for each of them in turn, or None
+            if the samples are to be calculated inline from self._seed_key
+        """
+        if self._seed is None:
+            return indices, self._rng.random
+        if np is None or isinstance(indices, tuple):
+            return indices, None
+        # Seeded samples are calculated in vectorised blocks, running ahead
+        # of the colours
+        indices, ahead = tee(indices)
+        return indices, _counter_uniform_blocks(self._seed_key,
+                                                ahead).__next__
+
+    def _jitter_array(self, n):
+        """ Return uniform [0, 1) jitter samples for the colours indexed by
+            the NumPy array n
+        """
+        if self._seed is not None:
+            return _counter_uniform_array(self._seed_key, n)
+        # One draw from the stream seeds a counter-based stream for the
+        # whole block, rather than making a draw for each colour
+        key = _mix64(int(self._rng.random() * 2 ** 53))
+        return _counter_uniform_array(key, n)
+
+    def _cache_key(self, k, offset):
+        """ Return a hashable key identifying the palette of k colours from
+            offset, or None if the palette is not reproducible (because it
+            has jitter from an unseeded stream).
+        """
+        if self._jitter and self._seed is None:
+            return None
+        key = (self._a, self._b, self._v_init, self._v_final, self._jitter,
+               self._seed if self._jitter else None, k, offset)
+        if self._lut is not None and self._lut.covers(offset):
+            # Interpolated palettes are kept apart from exact ones
+            key += ("lut", self._lut.tolerance, self._lut.offset)
+        return key
+
+    def _check_spiral(self, k, offset):
+        """ Check that k points from offset can be placed on the spiral
+
+            Raises ValueError if k is negative, or if a or b is zero (which
+            the setters permit), or so close to zero that the spiral angle
+            t is not finite.
+        """
+        assert offset > 0 and offset < 1, "offset must be in (0,1)"
+        if k < 0:
+            raise ValueError("The number of colours k must be >= 0, got %r"
+                             % k)
+        if self._a <= 0 or self._b <= 0:
+            raise ValueError("Spiral parameters a and b must be > 0, "
+                             "got a=%r, b=%r" % (self._a, self._b))
+        if k == 0:
+            # No points to place
+            return
+        # t is monotonic in n, so only the end points need to be checked
+        for n in (0, k):
+            t = (1./self._b) * (log(n + (k * offset)) -
+                                log((1 + offset) * k * self._a))
+            if not isfinite(t):
+                raise ValueError("Spiral parameters a=%r, b=%r give a "
+                                 "non-finite spiral angle for k=%d" %
+                                 (self._a, self._b, k))
 
     @property
     def a(self):
@@ -169,6 +854,7 @@ class ColorSpiral(object):
     def a(self, value):
         """ Setter for a attribute """
         self._a = max(0, value)
+        self._lut = None
 
     @property
     def b(self):
@@ -179,6 +865,7 @@ class ColorSpiral(object):
     def b(self, value):
         """ Setter for b attribute """
         self._b = max(0, value)
+        self._lut = None
 
     @property
     def v_init(self):
@@ -210,35 +897,2448 @@ class ColorSpiral(object):
         """ Setter for jitter attribute """
         self._jitter = max(0, min(1, value))
 
+    @property
+    def seed(self):
+        """ Source of brightness jitter """
+        if self._seed is not None:
+            return self._seed
+        return self._rng
 
-# Convenience functions for those who don't want to bother with a
-# ColorSpiral object
-def get_colors(k, **kwargs):
-    """Returns k colours selected by the ColorSpiral object, as a generator
+    @seed.setter
+    def seed(self, value):
+        """ Setter for seed attribute """
+        _check_seed(value)
+        if value is None:
+            self._seed, self._seed_key = None, None
+            self._rng = random.Random()
+        elif isinstance(value, numbers.Integral):
+            self._seed, self._seed_key = int(value), _mix64(int(value))
+            self._rng = None
+        else:
+            self._seed, self._seed_key = None, None
+            self._rng = value
 
-       Arguments:
 
-       o k - the number of colours to return
+class SpiralSpec(namedtuple("SpiralSpec", "a b v_init v_final jitter seed")):
+    """Immutable description of a spiral path through HSV colour space.
 
-       o **kwargs - pass-through arguments to the ColorSpiral object
+       Holds the parameters of a ColorSpiral, clamped to their permitted
+       ranges once, on construction, as by the ColorSpiral attribute
+       setters. Being a tuple, a SpiralSpec compares and hashes by value,
+       so may be used as a dictionary or cache key, has no per-instance
+       dictionary, and pickles as its six values. The seed is normally
+       None or an integer; other seeds, such as random.Random objects,
+       are kept as they are, and compare by identity.
+
+       PaletteCache.get() accepts a SpiralSpec in place of a ColorSpiral,
+       and only creates a ColorSpiral if the palette is not cached.
     """
-    cspiral = ColorSpiral(**kwargs)
-    return cspiral.get_colors(k)
+    __slots__ = ()
 
+    def __new__(cls, a=1, b=0.33, v_init=0.85, v_final=0.5, jitter=0.05,
+                seed=None):
+        """Create a spiral description; arguments are as for ColorSpiral"""
+        _check_seed(seed)
+        if isinstance(seed, numbers.Integral):
+            seed = int(seed)
+        return super(SpiralSpec, cls).__new__(
+            cls, max(0, a), max(0, b), max(0, min(1, v_init)),
+            max(0, min(1, v_final)), max(0, min(1, jitter)), seed)
 
-def get_color_dict(iterable, **kwargs):
-    """Returns a dictionary, keyed by the members of iterable l, with a
-       colour assigned to each member.
+    def spiral(self):
+        """Return a new ColorSpiral with these parameters"""
+        return ColorSpiral.from_spec(self)
 
-       Arguments:
+    def _cache_key(self, k, offset):
+        """ As ColorSpiral._cache_key(), so that a SpiralSpec and the
+            equivalent ColorSpiral share cached palettes
+        """
+        a, b, v_init, v_final, jitter, seed = self
+        if not jitter:
+            seed = None
+        elif not isinstance(seed, int):
+            return None
+        return (a, b, v_init, v_final, jitter, seed, k, offset)
 
-       o iterable - an iterable representing classes to be coloured
 
-       o **kwargs - pass-through arguments to the ColorSpiral object
+def _check_seed(seed):
+    """ Raise TypeError unless seed is None, an integer, or an object with
+        a random() method
     """
-    cspiral = ColorSpiral(**kwargs)
-    colors = cspiral.get_colors(len(iterable))
-    cdict = {}
-    for item in iterable:
-        cdict[item] = colors.next()
-    return cdict
+    if seed is None or isinstance(seed, numbers.Integral):
+        return
+    if not callable(getattr(seed, "random", None)):
+        raise TypeError("seed must be None, an integer or an object with a "
+                        "random() method, not %r" % (seed,))
+
+
+# Counter-based random stream for jitter. Each sample is a hash of the
+# (mixed) seed and the colour index, using the SplitMix64 finaliser, so
+# any colour's jitter can be computed independently of all the others.
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_GAMMA64 = 0x9E3779B97F4A7C15
+
+
+def _mix64(z):
+    """ SplitMix64 finaliser: scramble the bits of a 64-bit integer """
+    z &= _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _counter_uniform(key, n):
+    """ Return the uniform [0, 1) sample for index n of stream key """
+    return (_mix64(key + n * _GAMMA64) >> 11) * (1.0 / (1 << 53))
+
+
+def _counter_uniform_blocks(key, indices, size=4096):
+    """ Generator of _counter_uniform(key, n) for n in the iterator
+        indices, calculated in vectorised blocks of size samples
+    """
+    while True:
+        block = list(islice(indices, size))
+        if not block:
+            return
+        yield from _counter_uniform_array(key, block).tolist()
+
+
+def _counter_uniform_array(key, n):
+    """ Vectorised _counter_uniform(), for an array of indices n """
+    z = np.asarray(n).astype(np.uint64) * np.uint64(_GAMMA64) + \
+        np.uint64(key)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return (z >> np.uint64(11)).astype(float) * (1.0 / (1 << 53))
+
+
+def _fill_shared_colors(spec, name, k, offset, start, stop):
+    """ Worker for ColorSpiral.get_colors_array(): write colours start to
+        stop of k from the spiral described by the SpiralSpec spec into the
+        (k, 3) array in shared memory block name
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        colors = np.ndarray((k, 3), buffer=shm.buf)
+        colors[start:stop] = spec.spiral()._colors_array(
+            np.arange(start + 1, stop + 1, dtype=float), k, offset)
+        del colors
+    finally:
+        shm.close()
+
+
+def _rgb8_array(rgb):
+    """ Vectorised _to_byte(): convert an array of colour channel values
+        in [0, 1] to a uint8 array
+    """
+    return np.floor(np.clip(rgb, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def _pack_rgb8(rgb8):
+    """ Pack an (n, 3) uint8 array of RGB values as uint32 0xRRGGBB """
+    rgb8 = rgb8.astype(np.uint32)
+    return (rgb8[:, 0] << 16) | (rgb8[:, 1] << 8) | rgb8[:, 2]
+
+
+def _category_codes(codes):
+    """ Return (codes, k) for an array of integer category codes, or a
+        pandas Categorical (or categorical Series), or a pyarrow
+        DictionaryArray. k is the number of categories, or None if codes
+        is a plain array. Missing values are given the code -1.
+    """
+    if hasattr(codes, "cat"):
+        # pandas Series of categorical dtype
+        codes = codes.cat
+    if hasattr(codes, "codes") and hasattr(codes, "categories"):
+        # pandas Categorical, which uses -1 for missing values
+        return np.asarray(codes.codes), len(codes.categories)
+    if hasattr(codes, "indices") and hasattr(codes, "dictionary"):
+        # pyarrow DictionaryArray, which may hold nulls
+        indices = codes.indices.fill_null(-1)
+        return indices.to_numpy(zero_copy_only=False), len(codes.dictionary)
+    codes = np.asarray(codes)
+    if codes.dtype.kind not in "iu":
+        if codes.size:
+            raise TypeError("category codes must be integers, not %s" %
+                            codes.dtype)
+        # An empty list gives an empty float array
+        codes = codes.astype(np.intp)
+    return codes, None
+
+
+def _rgb_to_lab_array(rgb):
+    """ Convert an (n, 3) array of sRGB values in [0, 1] to CIELAB, with
+        the D65 white point
+    """
+    rgb = np.clip(rgb, 0, 1)
+    linear = np.where(rgb <= 0.04045, rgb / 12.92,
+                      ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear.dot(np.array([[0.4124564, 0.2126729, 0.0193339],
+                               [0.3575761, 0.7151522, 0.1191920],
+                               [0.1804375, 0.0721750, 0.9503041]]))
+    xyz /= (0.95047, 1.0, 1.08883)
+    f = np.where(xyz > (6 / 29.) ** 3, np.cbrt(xyz),
+                 xyz / (3 * (6 / 29.) ** 2) + 4 / 29.)
+    return np.column_stack((116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]),
+                            200 * (f[:, 1] - f[:, 2])))
+
+
+def _nearest_distances(points):
+    """ Return the distance from each row of the (n, 3) array points to
+        its nearest neighbour among the other rows
+
+        Points are sorted into a grid of cubic cells, a little larger than
+        most nearest neighbour distances (estimated from a sample) on a
+        side, and each point is compared only with the points in its own
+        and the 26 adjacent cells. The few points with no neighbour within
+        one cell are searched for again with cells twice the size, and so
+        on. For points spread along the spiral this takes O(n log n) time,
+        for the sorts.
+    """
+    n = len(points)
+    best = np.full(n, np.inf)
+    if n < 2:
+        return best
+    # Estimate the typical nearest neighbour distance from a sample, a few
+    # rows at a time to bound memory use
+    sample = points[np.linspace(0, n - 1, min(n, 256)).astype(np.intp)]
+    squares = (points ** 2).sum(axis=1)
+    sample_d2 = []
+    for rows in range(0, len(sample), 8):
+        rows = sample[rows:rows + 8]
+        d2 = (rows ** 2).sum(axis=1)[:, None] + squares[None, :] - \
+            2 * rows.dot(points.T)
+        d2[d2 <= 1e-12] = np.inf
+        sample_d2.extend(d2.min(axis=1))
+    cell = 1.5 * np.sqrt(np.percentile(sample_d2, 90))
+    if not np.isfinite(cell) or cell == 0:
+        cell = 1.0
+    queries = np.arange(n)
+    while len(queries):
+        _grid_nearest(points, queries, cell, best)
+        # A neighbour further than one cell away may be in a non-adjacent
+        # cell, so may not be the nearest
+        queries = queries[best[queries] > cell]
+        cell *= 2
+    return best
+
+
+def _grid_nearest(points, queries, cell, best):
+    """ Update best with the distance from the points indexed by queries
+        to their nearest neighbours in the same or adjacent cells of a grid
+        of cubic cells of side cell
+    """
+    cells = np.floor((points - points.min(axis=0)) / cell).astype(np.int64)
+    dims = cells.max(axis=0) + 3
+    keys = ((cells[:, 0] + 1) * dims[1] + cells[:, 1] + 1) * dims[2] + \
+        cells[:, 2] + 1
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    # Searching for the queries' cells in sorted order is much faster
+    queries = queries[np.argsort(keys[queries], kind="stable")]
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            for dk in (-1, 0, 1):
+                other = keys[queries] + (di * dims[1] + dj) * dims[2] + dk
+                start = np.searchsorted(sorted_keys, other, "left")
+                counts = np.searchsorted(sorted_keys, other, "right") - start
+                for j in range(counts.max()):
+                    have = np.nonzero(counts > j)[0]
+                    query, candidate = queries[have], order[start[have] + j]
+                    distinct = candidate != query
+                    query, candidate = query[distinct], candidate[distinct]
+                    dist = np.sqrt(((points[query] - points[candidate]) **
+                                    2).sum(axis=1))
+                    best[query] = np.minimum(best[query], dist)
+
+
+# Step between successive points of the open-ended sequence used by
+# ColorSpiral.get_stable_colors(): the fractional part of the golden ratio
+_GOLDEN = (5 ** 0.5 - 1) / 2
+
+
+def _stable_hash(key):
+    """ Return a 64-bit hash of key that is the same in every process """
+    if isinstance(key, bytes):
+        data = key
+    else:
+        data = str(key).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(),
+                          "big")
+
+
+def _jump_hash(key, buckets):
+    """ Jump consistent hash of a 64-bit integer key into [0, buckets)
+
+        See Lamping & Veach (2014) "A Fast, Minimal Memory, Consistent Hash
+        Algorithm", arXiv:1406.2294
+    """
+    if buckets < 1:
+        raise ValueError("buckets must be at least 1")
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & _MASK64
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def _require_numpy(caller):
+    """ Raise ImportError if NumPy is not available to caller """
+    if np is None:
+        raise ImportError("Install NumPy if you want to use %s" % caller)
+
+
+def _spiral_rgb_array(n, k, offset, a, b, v_init, v_final, jitter,
+                      out=None):
+    """ Return the RGB colour space values for the points numbered by the
+        NumPy array n (in [1, k]) of k along spirals with parameters a, b,
+        v_init and v_final, with V offset by jitter.
+
+        The parameters and jitter may be scalars, or arrays that broadcast
+        against n; the result has their broadcast shape, plus a last axis
+        of length 3. It is written into out, if given.
+    """
+    v_rate = (v_final - v_init) / float(k)
+    # t, h and r are as calculated in ColorSpiral.get_colors()
+    t = (1./b) * (np.log(n + (k * offset)) - np.log((1 + offset) * k * a))
+    h = _spiral_hue_array(t)
+    r = a * np.exp(b * t)
+    v = v_init + (n * v_rate + jitter)
+    return _hsv_to_rgb_array(h, r, np.clip(v, 0, 1), out)
+
+
+def _spiral_hue_array(t):
+    """ Return the HSV hue, in [0, 1], for an array of spiral angles t, as
+        calculated in ColorSpiral.get_colors()
+    """
+    h = np.where(t < 0, np.fmod(t, 2 * pi), t)
+    h = np.where(h < 0, h + 2 * pi, h)
+    h = (h - (np.floor(h/(2 * pi)) * pi))
+    h /= 2 * pi
+    return h
+
+
+def _hsv_to_rgb_array(h, s, v, out=None):
+    """ Vectorised equivalent of colorsys.hsv_to_rgb()
+
+        Takes arrays of H, S and V values, which are broadcast together,
+        and returns an array of the corresponding RGB values with an
+        extra last axis of length 3 (which is out, if given).
+    """
+    i = np.floor(h * 6.0)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(int) % 6
+    # Each of the six hue sectors takes its RGB values from a different
+    # permutation of (v, t, p, q), as in colorsys
+    return np.stack((np.choose(i, (v, q, p, p, t, v)),
+                     np.choose(i, (t, v, v, q, p, p)),
+                     np.choose(i, (p, p, t, v, v, q))), axis=-1, out=out)
+
+
+class _SpiralTable(object):
+    """Lookup table of colours along a spiral, for ColorSpiral.build_lut()
+
+       Along the spiral, the saturation r = a * exp(b * t) is equal to
+       u = (x + k * offset) / ((1 + offset) * k) for the point at position
+       x of k, and the hue is a function of u alone, so one table of RGB
+       values at V = 1, evenly spaced in u, serves every k. As the HSV to
+       RGB conversion is linear in V, colours are then scaled by their V.
+
+       The hue jumps where the spiral angle t passes a multiple of 2 * pi
+       (see get_colors()), and interpolating across a jump would give
+       colours from neither side, so colours in table intervals containing
+       one are calculated directly instead, by the caller.
+    """
+    __slots__ = ("a", "b", "tolerance", "offset", "u_min", "inv_du",
+                 "table", "slopes", "flags", "values", "direct")
+
+    def __init__(self, a, b, tolerance, offset, max_size):
+        """Build the smallest table, doubling in size from 1024 entries,
+           with interpolation error within tolerance at check points
+           spaced through each interval
+        """
+        self.a, self.b = a, b
+        self.tolerance, self.offset = tolerance, offset
+        self.u_min = offset / (1. + offset)
+        # Error is checked at quarters of each interval, but may peak
+        # between them (at a hue sector boundary): the peak is at most
+        # 3/2 of the largest checked error
+        target = tolerance / 1.5
+        size = 1024
+        while True:
+            u = np.linspace(self.u_min, 1, size + 1)
+            self.inv_du = size / (1 - self.u_min)
+            self.table = self._unit_rgb(u)
+            self.slopes = np.diff(self.table, axis=0)
+            # Intervals in which t crosses a multiple of 2 * pi
+            cycle = np.floor((np.log(u) - log(a)) / (2 * pi * b))
+            self.flags = cycle[1:] != cycle[:-1]
+            checks = (u[:-1, None] + np.array([0.25, 0.5, 0.75]) *
+                      (u[1] - u[0])).ravel()
+            error = np.abs(self.interpolate(checks)[0] -
+                           self._unit_rgb(checks))
+            error = error[~np.repeat(self.flags, 3)].max(initial=0)
+            if error <= target:
+                break
+            if size >= max_size:
+                raise ValueError("A lookup table of %d entries is not "
+                                 "within tolerance %g (error %g)" %
+                                 (size, tolerance, error * 1.5))
+            # Near hue sector boundaries, error falls in proportion to the
+            # table spacing, so grow by the remaining factor at once
+            size = min(max_size, size * max(2, min(64, 2 ** int(
+                np.ceil(np.log2(error / target))))))
+        # Made for the pure Python generator when first needed
+        self.values = self.direct = None
+
+    def _unit_rgb(self, u):
+        """Return the (n, 3) array of RGB values at V = 1 for an array of
+           positions u, calculated directly
+        """
+        t = (np.log(u) - log(self.a)) / self.b
+        return _hsv_to_rgb_array(_spiral_hue_array(t),
+                                 self.a * np.exp(self.b * t), 1.0)
+
+    def python_tables(self):
+        """Return (the RGB values and slopes of each interval, as a flat
+           array, and a list of the intervals to calculate directly), for
+           the pure Python generator
+        """
+        if self.values is None:
+            self.values = array('d', np.hstack(
+                (self.table[:-1], self.slopes)).tobytes())
+            self.direct = self.flags.tolist()
+        return self.values, self.direct
+
+    def interpolate(self, u):
+        """Return (RGB values at V = 1, interpolated from the table, and a
+           boolean array marking those to be calculated directly) for an
+           array of positions u
+        """
+        pos = (u - self.u_min) * self.inv_du
+        i = np.minimum(pos.astype(np.intp), len(self.flags) - 1)
+        rgb = self.slopes.take(i, axis=0)
+        rgb *= (pos - i)[:, None]
+        rgb += self.table.take(i, axis=0)
+        return rgb, self.flags.take(i)
+
+    def covers(self, offset):
+        """Return True if the table covers spirals started at offset"""
+        return offset >= self.offset
+
+    @property
+    def nbytes(self):
+        """Size of the table in bytes"""
+        nbytes = self.table.nbytes + self.slopes.nbytes + self.flags.nbytes
+        if self.values is not None:
+            nbytes += (len(self.values) * self.values.itemsize +
+                       sys.getsizeof(self.direct))
+        return nbytes
+
+
+class Palette(object):
+    """An immutable sequence of RGB colours, held in a contiguous buffer.
+
+       Each colour takes 24 bytes as double precision floats (typecode
+       'd'), 12 bytes as single precision floats ('f'), or three bytes as
+       8-bit integers in [0, 255] ('B'), rather than the 100 or more bytes
+       of a tuple of Python floats. Indexing a Palette returns an RGB
+       tuple; slicing returns a Palette sharing the same buffer.
+
+       The colours are available without copying as a read-only
+       memoryview of shape (len(palette), 3), from the buffer attribute,
+       or as a NumPy array from to_array().
+    """
+    def __init__(self, data, typecode='d'):
+        """Initialise a palette from a flat buffer of RGB values
+
+           Arguments:
+
+           o data - object supporting the buffer protocol, such as an
+                    array.array or NumPy array, holding R, G, B values for
+                    each colour in turn. The buffer is not copied.
+
+           o typecode - array typecode of the values in data: 'd', 'f' or
+                        'B'
+        """
+        if typecode not in ('d', 'f', 'B'):
+            raise ValueError("typecode must be 'd', 'f' or 'B', not %r" %
+                             typecode)
+        view = memoryview(data)
+        if not view.nbytes:
+            # Views with a zero in their shape cannot be cast
+            view = memoryview(b"")
+        view = view.cast('B').cast(typecode)
+        if len(view) % 3:
+            raise ValueError("Palette data must hold RGB triples")
+        self._data = view.toreadonly()
+        self.typecode = typecode
+
+    @classmethod
+    def from_colors(cls, colors, typecode='d'):
+        """Return a new palette of the RGB tuples from the iterable colors"""
+        return cls(array(typecode, chain.from_iterable(colors)), typecode)
+
+    @property
+    def buffer(self):
+        """Read-only memoryview of the colours, with shape (len, 3)"""
+        if not len(self._data):
+            return self._data
+        return self._data.cast('B').cast(self.typecode, (len(self), 3))
+
+    @property
+    def nbytes(self):
+        """Size of the palette's buffer, in bytes"""
+        return self._data.nbytes
+
+    def to_array(self):
+        """Return the colours as a read-only (len, 3) NumPy array view"""
+        _require_numpy("Palette.to_array()")
+        return np.frombuffer(self._data, dtype=self.typecode).reshape(-1, 3)
+
+    @_instrumented("self")
+    def to_rgb8(self):
+        """Return the palette with colours as 8-bit integer RGB values"""
+        if self.typecode == 'B':
+            return self
+        if np is not None:
+            return Palette(_rgb8_array(self.to_array()), 'B')
+        return Palette(array('B', [_to_byte(x) for x in self._data]), 'B')
+
+    @_instrumented("self")
+    def to_packed(self):
+        """Return a list of the colours as 0xRRGGBB integers"""
+        if np is not None:
+            return _pack_rgb8(self.to_rgb8().to_array()).tolist()
+        return [(r << 16) | (g << 8) | b for r, g, b in self.to_rgb8()]
+
+    @_instrumented("self")
+    def to_hex(self):
+        """Return a list of the colours as '#rrggbb' strings"""
+        return ["#%06x" % rgb for rgb in self.to_packed()]
+
+    def to_reportlab(self):
+        """Return a list of the colours as ReportLab Color objects"""
+        from reportlab.lib.colors import Color
+        if self.typecode == 'B':
+            return [Color(r / 255., g / 255., b / 255.) for r, g, b in self]
+        return [Color(r, g, b) for r, g, b in self]
+
+    def __len__(self):
+        return len(self._data) // 3
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return Palette(self._data[3 * start:3 * max(start, stop)],
+                               self.typecode)
+            return Palette.from_colors((self[i] for i in
+                                        range(start, stop, step)),
+                                       self.typecode)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("palette index out of range")
+        return tuple(self._data[3 * index:3 * index + 3])
+
+    def __iter__(self):
+        data = self._data
+        for i in range(0, len(data), 3):
+            yield tuple(data[i:i + 3])
+
+    def __eq__(self, other):
+        if not isinstance(other, Palette):
+            return NotImplemented
+        return self._data == other._data
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Palette(<%d colours>, typecode=%r)" % (len(self),
+                                                       self.typecode)
+
+
+def _to_byte(x):
+    """ Convert a colour channel value in [0, 1] to an integer in [0, 255],
+        rounding to nearest and clamping out-of-range values
+    """
+    return int(max(0, min(x, 1)) * 255 + 0.5)
+
+
+# Output formats for colours, given by the fmt argument of get_colors()
+# and related functions: tuples of RGB floats in [0, 1], as calculated;
+# tuples of 8-bit integer RGB values; 0xRRGGBB integers; or '#rrggbb'
+# strings. For the integer formats, each channel is clamped to [0, 1] and
+# rounded to the nearest of the 256 levels, with halves rounded up, as by
+# _to_byte() (so -0.0 gives 0, and 0.5 gives 128).
+_FORMATS = ("float", "rgb8", "packed", "hex")
+
+
+def _check_format(fmt):
+    """ Raise ValueError if fmt is not one of the colour output formats """
+    if fmt not in _FORMATS:
+        raise ValueError("fmt must be one of %s, got %r" %
+                         (", ".join(_FORMATS), fmt))
+
+
+def _format_color(color, fmt):
+    """ Convert an RGB float colour tuple to the output format fmt """
+    if fmt == "float":
+        return color
+    r, g, b = [_to_byte(x) for x in color]
+    if fmt == "rgb8":
+        return r, g, b
+    if fmt == "packed":
+        return (r << 16) | (g << 8) | b
+    return "#%02x%02x%02x" % (r, g, b)
+
+
+def _format_colors(colors, fmt):
+    """ Return an iterator converting the RGB float colour tuples of
+        colors to the output format fmt, one at a time
+    """
+    if fmt == "float":
+        return iter(colors)
+    return (_format_color(color, fmt) for color in colors)
+
+
+def _palette_colors(palette, fmt):
+    """ Return the colours of a Palette in the output format fmt, converted
+        in bulk
+    """
+    if fmt == "float":
+        return palette
+    if fmt == "rgb8":
+        return palette.to_rgb8()
+    if fmt == "packed":
+        return palette.to_packed()
+    return palette.to_hex()
+
+
+@_instrumented()
+def get_colors_sweep(k, a=1, b=0.33, v_init=0.85, v_final=0.5, jitter=0.05,
+                     seed=None, offset=0.1):
+    """Returns the palettes of k colours from many spirals at once, as an
+       (m, k, 3) NumPy array. Requires NumPy.
+
+       Each spiral parameter may be a single value, or a sequence of m
+       values (one per spiral); they are broadcast together, and the
+       palettes of all m spirals are calculated in one set of array
+       operations. Values are clamped as by the ColorSpiral attribute
+       setters, and the palette of spiral i is the same as that from
+       ColorSpiral.get_colors_array() for a ColorSpiral with the ith
+       parameters. All spirals share the same jitter samples, scaled by
+       their own jitter.
+
+       Arguments:
+
+       o k - the number of colours in each palette
+
+       o a, b, v_init, v_final, jitter - spiral parameters, as for
+                                         ColorSpiral
+
+       o seed - source of jitter values, as for ColorSpiral
+
+       o offset - how far along the spiral path to start.
+    """
+    _require_numpy("get_colors_sweep()")
+    assert offset > 0 and offset < 1, "offset must be in (0,1)"
+    if k < 0:
+        raise ValueError("The number of colours k must be >= 0, got %r" % k)
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                   for x in (a, b, v_init, v_final, jitter)])
+    if params[0].ndim != 1:
+        raise ValueError("Spiral parameters must be scalars or "
+                         "one-dimensional")
+    a, b = np.maximum(params[0], 0), np.maximum(params[1], 0)
+    v_init, v_final, jitter = [np.clip(x, 0, 1) for x in params[2:]]
+    bad = (a <= 0) | (b <= 0)
+    if k:
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            ends = (1./b[:, None]) * (
+                np.log(np.array([0, k]) + (k * offset)) -
+                np.log((1 + offset) * k * a[:, None]))
+        bad |= ~np.isfinite(ends).all(1)
+    bad = np.flatnonzero(bad)
+    if len(bad):
+        i = bad[0]
+        raise ValueError("Spiral parameters a=%r, b=%r (spiral %d) do not "
+                         "give a finite spiral for k=%d" %
+                         (float(a[i]), float(b[i]), i, k))
+    if k == 0:
+        return np.empty((len(a), 0, 3))
+    n = np.arange(1, k + 1, dtype=float)
+    if jitter.any():
+        samples = ColorSpiral(seed=seed)._jitter_array(n)
+        jitter = samples * 2 * jitter[:, None] - jitter[:, None]
+    else:
+        jitter = 0
+    return _spiral_rgb_array(n, k, offset, a[:, None], b[:, None],
+                             v_init[:, None], v_final[:, None], jitter)
+
+
+@_instrumented("colors")
+def evaluate_palette(colors):
+    """Return a dictionary of measures of how well separated the colours
+       of a palette are. Requires NumPy.
+
+       Colours are converted to CIELAB, and the colour difference (CIE76
+       Delta E, the Euclidean distance in CIELAB) from each colour to its
+       nearest neighbour in the palette found with a spatial grid index, in
+       O(k log k) time rather than comparing all pairs. The measures are:
+
+       o k - the number of colours
+
+       o min_delta_e - the smallest difference between any two colours
+
+       o mean_delta_e, median_delta_e - the mean and median difference
+                                        between each colour and its nearest
+                                        neighbour
+
+       Arguments:
+
+       o colors - a Palette, (k, 3) array or iterable of RGB tuples, with
+                  values in [0, 1]
+    """
+    _require_numpy("evaluate_palette()")
+    if isinstance(colors, Palette):
+        colors = colors.to_array()
+    rgb = np.asarray(colors if hasattr(colors, "__len__") else list(colors),
+                     dtype=float).reshape(-1, 3)
+    distances = _nearest_distances(_rgb_to_lab_array(rgb))
+    if len(distances) < 2:
+        return {"k": len(distances), "min_delta_e": float("inf"),
+                "mean_delta_e": float("inf"), "median_delta_e": float("inf")}
+    return {"k": len(distances),
+            "min_delta_e": float(distances.min()),
+            "mean_delta_e": float(distances.mean()),
+            "median_delta_e": float(np.median(distances))}
+
+
+def tune_spiral(k, budget=5.0, offset=0.1, batch=16, seed=None,
+                jitter_seed=None, **kwargs):
+    """Search for the spiral parameters giving the best-separated palette
+       of k colours within a time budget, returning (ColorSpiral, measures).
+       Requires NumPy.
+
+       Palettes are compared by the smallest colour difference between any
+       two of their colours, then by the mean nearest neighbour difference,
+       as measured by evaluate_palette(). Each round evaluates a batch of
+       candidate spirals, calculated together by get_colors_sweep(): at
+       first drawn at random from the parameter space, and then
+       increasingly by perturbing the best so far.
+
+       Arguments:
+
+       o k - the number of colours in the palette
+
+       o budget - time to search for, in seconds. At least one batch is
+                  always evaluated.
+
+       o offset - how far along the spiral path to start.
+
+       o batch - the number of candidate spirals in each round
+
+       o seed - seed for the random search, for reproducible results
+
+       o jitter_seed - integer seed for the jitter of every candidate
+                       spiral, so that the spiral returned gives the
+                       palette that was measured. By default, with jitter,
+                       one is drawn from the random search.
+
+       o **kwargs - ColorSpiral arguments (for instance, jitter) that are
+                    held fixed rather than searched over. By default jitter
+                    is 0.
+    """
+    _require_numpy("tune_spiral()")
+    kwargs.setdefault("jitter", 0)
+    rng = random.Random(seed)
+    if jitter_seed is None and kwargs["jitter"]:
+        jitter_seed = rng.getrandbits(63)
+    if jitter_seed is not None:
+        kwargs["seed"] = jitter_seed
+    deadline = time.monotonic() + budget
+    ranges = {"a": (0.1, 10, True), "b": (0.05, 2, True),
+              "v_init": (0.5, 1, False), "v_final": (0.2, 1, False)}
+    ranges = dict((name, bounds) for name, bounds in ranges.items()
+                  if name not in kwargs)
+    best, best_score, best_measures = None, None, None
+    spread = 1.0
+    while best is None or time.monotonic() < deadline:
+        candidates = []
+        for _ in range(batch):
+            params = {}
+            for name, (low, high, logscale) in ranges.items():
+                if logscale:
+                    low, high = log(low), log(high)
+                if best is None or rng.random() < 0.25:
+                    value = rng.uniform(low, high)
+                else:
+                    value = getattr(best, name)
+                    value = log(value) if logscale else value
+                    value += rng.gauss(0, spread * (high - low) / 4)
+                    value = max(low, min(high, value))
+                params[name] = exp(value) if logscale else value
+            params.update(kwargs)
+            candidates.append(ColorSpiral(**params))
+        # Each batch of palettes is calculated in one sweep
+        palettes = get_colors_sweep(
+            k, offset=offset, seed=jitter_seed,
+            **dict((name, [getattr(c, name) for c in candidates])
+                   for name in ("a", "b", "v_init", "v_final", "jitter")))
+        for cspiral, colors in zip(candidates, palettes):
+            measures = evaluate_palette(colors)
+            score = (measures["min_delta_e"], measures["mean_delta_e"])
+            if best_score is None or score > best_score:
+                best, best_score, best_measures = cspiral, score, measures
+        spread = max(0.05, spread * 0.7)
+    return best, best_measures
+
+
+class PaletteIndex(object):
+    """Reverse index from RGB colours back to the categories of a palette.
+
+       Colours are quantised to 8 bits per channel, as for Palette.to_rgb8(),
+       so that colours read back from rendered images can be matched. Exact
+       matches are found by hashing the packed 8-bit colour; the nearest
+       palette colour (by Euclidean distance in 8-bit RGB space) is found
+       by searching a grid of cubic buckets outwards from the query colour.
+       Where several categories have the same 8-bit colour, the first is
+       returned.
+    """
+    def __init__(self, colors, keys=None, cell=16):
+        """Initialise an index of a palette
+
+           Arguments:
+
+           o colors - a Palette, or iterable of RGB colour tuples with
+                      values in [0, 1]
+
+           o keys - the category for each colour; by default, its index
+
+           o cell - edge of the grid buckets, in 8-bit colour units
+        """
+        if not isinstance(colors, Palette):
+            colors = Palette.from_colors(colors)
+        self.rgb8 = colors.to_rgb8()
+        self.keys = list(range(len(self.rgb8)) if keys is None else keys)
+        if len(self.keys) != len(self.rgb8):
+            raise ValueError("keys and colors must be the same length")
+        self.cell = cell
+        self._exact = {}
+        self._grid = {}
+        self._sorted = None
+        for index, (r, g, b) in enumerate(self.rgb8):
+            self._exact.setdefault((r << 16) | (g << 8) | b, index)
+            self._grid.setdefault((r // cell, g // cell, b // cell),
+                                  []).append(index)
+
+    @classmethod
+    def from_dict(cls, cdict, cell=16):
+        """Return an index of the colours of a dictionary from
+           get_color_dict(), mapping them back to its keys
+        """
+        return cls(list(cdict.values()), list(cdict.keys()), cell)
+
+    def lookup(self, color, tolerance=0):
+        """Return the category of the palette colour matching color, or None
+
+           Arguments:
+
+           o color - RGB tuple, of floats in [0, 1] or integers in [0, 255]
+
+           o tolerance - if greater than zero, return the category of the
+                         nearest palette colour within this Euclidean
+                         distance in 8-bit RGB space, if there is no exact
+                         match
+        """
+        index = self.lookup_index(color, tolerance)
+        return None if index is None else self.keys[index]
+
+    def lookup_index(self, color, tolerance=0):
+        """Return the index of the palette colour matching color, or None,
+           as for lookup()
+        """
+        r, g, b = _quantise_color(color)
+        index = self._exact.get((r << 16) | (g << 8) | b)
+        if index is None and tolerance > 0:
+            index = self.nearest_index((r, g, b), tolerance)[0]
+        return index
+
+    def nearest_index(self, color, tolerance=None):
+        """Return (index, distance) of the palette colour nearest to color,
+           which is an RGB tuple of floats in [0, 1] or integers in
+           [0, 255], with the Euclidean distance in 8-bit RGB space.
+           Of equally near colours, the one with the lowest index is
+           returned.
+
+           If tolerance is given, only buckets that may hold colours within
+           this distance are searched, and (None, inf) is returned if there
+           are none.
+        """
+        r, g, b = _quantise_color(color)
+        cell = self.cell
+        cr, cg, cb = r // cell, g // cell, b // cell
+        radii = 255 // cell + 1
+        if tolerance is not None:
+            # Colours in buckets more than ceil(tolerance / cell) from the
+            # colour's own bucket are further away than tolerance
+            radii = min(radii, int(ceil(tolerance / cell)) + 1)
+        rgb8 = self.rgb8
+        best, best_d2 = None, None
+        for radius in range(radii):
+            for bucket in self._shell(cr, cg, cb, radius):
+                for index in self._grid.get(bucket, ()):
+                    pr, pg, pb = rgb8[index]
+                    d2 = (pr - r) ** 2 + (pg - g) ** 2 + (pb - b) ** 2
+                    if best_d2 is None or d2 < best_d2 or \
+                            (d2 == best_d2 and index < best):
+                        best, best_d2 = index, d2
+            # Colours in buckets beyond this shell are more than radius
+            # cells away
+            if best_d2 is not None and best_d2 <= (radius * cell) ** 2:
+                break
+        if best is None or (tolerance is not None and
+                            best_d2 ** 0.5 > tolerance):
+            return None, float("inf")
+        return best, best_d2 ** 0.5
+
+    def _shell(self, cr, cg, cb, radius):
+        """Generator of the grid buckets on the faces of the cube of buckets
+           at radius from bucket (cr, cg, cb), within the colour cube
+        """
+        if radius == 0:
+            yield cr, cg, cb
+            return
+        top = 255 // self.cell
+        reds = range(max(cr - radius + 1, 0), min(cr + radius - 1, top) + 1)
+        greens = range(max(cg - radius, 0), min(cg + radius, top) + 1)
+        inner_greens = range(max(cg - radius + 1, 0),
+                             min(cg + radius - 1, top) + 1)
+        blues = range(max(cb - radius, 0), min(cb + radius, top) + 1)
+        # Faces of constant red cover the whole green and blue ranges,
+        # faces of constant green the inner red range, and faces of
+        # constant blue the inner red and green ranges, so that no bucket
+        # is repeated
+        for i in (cr - radius, cr + radius):
+            if 0 <= i <= top:
+                for j in greens:
+                    for k in blues:
+                        yield i, j, k
+        for j in (cg - radius, cg + radius):
+            if 0 <= j <= top:
+                for i in reds:
+                    for k in blues:
+                        yield i, j, k
+        for k in (cb - radius, cb + radius):
+            if 0 <= k <= top:
+                for i in reds:
+                    for j in inner_greens:
+                        yield i, j, k
+
+    def lookup_array(self, colors, tolerance=0):
+        """Return an array of the palette indices of an array of colours,
+           such as an image, with -1 where there is no match. Requires
+           NumPy.
+
+           Exact matches are found for the whole array by binary search of
+           the sorted palette. The nearest palette colours to the distinct
+           unmatched colours are then found together, by comparing them
+           with the palette colours in each neighbouring bucket within
+           tolerance in turn, or with the whole palette if that is cheaper.
+
+           Arguments:
+
+           o colors - array of shape (..., 3), of floats in [0, 1] or
+                      8-bit integers
+
+           o tolerance - as for lookup()
+        """
+        _require_numpy("PaletteIndex.lookup_array()")
+        colors = np.asarray(colors)
+        if colors.dtype.kind == 'f':
+            colors = _rgb8_array(colors)
+        packed = _pack_rgb8(colors.reshape(-1, 3))
+        if self._sorted is None:
+            keys = np.array(sorted(self._exact), dtype=np.uint32)
+            self._sorted = (keys, np.array([self._exact[key]
+                                            for key in keys.tolist()],
+                                           dtype=np.intp))
+        keys, indices = self._sorted
+        result = np.full(packed.shape, -1, dtype=np.intp)
+        if len(keys):
+            found = np.searchsorted(keys, packed).clip(0, len(keys) - 1)
+            match = keys[found] == packed
+            result[match] = indices[found[match]]
+        if tolerance > 0 and len(keys):
+            missing = result == -1
+            unique, inverse = np.unique(packed[missing], return_inverse=True)
+            result[missing] = self._nearest_array(unique,
+                                                  tolerance)[inverse.ravel()]
+        return result.reshape(colors.shape[:-1])
+
+    def _nearest_array(self, packed, tolerance):
+        """Return an array of the indices of the nearest palette colours
+           within tolerance of an array of packed 8-bit colours, or -1,
+           as for nearest_index()
+        """
+        cell = self.cell
+        top = 255 // cell
+        shift = np.array([16, 8, 0], dtype=np.uint32)
+        query = ((packed[:, None] >> shift) & 255).astype(np.int32)
+        palette = np.asarray(self.rgb8, dtype=np.int32).reshape(-1, 3)
+        best = np.full(len(query), -1, dtype=np.intp)
+        best_d2 = np.full(len(query), np.iinfo(np.int32).max, dtype=np.int32)
+        radius = min(top, int(ceil(tolerance / cell)))
+        sizes = [len(bucket) for bucket in self._grid.values()]
+        # Each comparison with a neighbouring bucket costs several times as
+        # much as a comparison with one colour of the whole palette
+        if 8 * (2 * radius + 1) ** 3 * (max(sizes) + 2) < len(palette):
+            # Palette colours sorted by bucket, with the buckets numbered
+            # in raster order
+            weights = np.array([(top + 1) ** 2, top + 1, 1], dtype=np.int32)
+            buckets = (palette // cell) @ weights
+            order = np.argsort(buckets, kind="stable")
+            buckets = buckets[order]
+            home = query // cell
+            offsets = range(-radius, radius + 1)
+            for offset in product(offsets, offsets, offsets):
+                near = home + np.array(offset, dtype=np.int32)
+                inside = ((near >= 0) & (near <= top)).all(axis=1)
+                bucket = near @ weights
+                first = np.searchsorted(buckets, bucket, "left")
+                counts = np.searchsorted(buckets, bucket, "right") - first
+                counts[~inside] = 0
+                for member in range(counts.max(initial=0)):
+                    rows = np.flatnonzero(counts > member)
+                    candidates = order[first[rows] + member]
+                    self._closer(query, palette, rows, candidates, best,
+                                 best_d2)
+        else:
+            # Compare with the whole palette, in blocks of queries to bound
+            # the memory used. Squared distances are expanded as
+            # |q|^2 - 2 q.p + |p|^2, which is exact in floating point for
+            # 8-bit colours
+            step = max(1, 2 ** 20 // len(palette))
+            points = palette.astype(float)
+            norms = (points ** 2).sum(axis=1)
+            for start in range(0, len(query), step):
+                block = query[start:start + step].astype(float)
+                d2 = norms - 2 * block @ points.T
+                nearest = d2.argmin(axis=1)
+                best[start:start + step] = nearest
+                best_d2[start:start + step] = (
+                    d2[np.arange(len(block)), nearest] +
+                    (block ** 2).sum(axis=1))
+        best[np.sqrt(best_d2) > tolerance] = -1
+        return best
+
+    @staticmethod
+    def _closer(query, palette, rows, candidates, best, best_d2):
+        """Update best and best_d2 where palette colours candidates are
+           nearer to query colours rows than the best so far, or as near
+           with a lower index
+        """
+        d2 = ((palette[candidates] - query[rows]) ** 2).sum(axis=1)
+        current = best_d2[rows]
+        closer = (d2 < current) | ((d2 == current) &
+                                   (candidates < best[rows]))
+        rows = rows[closer]
+        best[rows] = candidates[closer]
+        best_d2[rows] = d2[closer]
+
+
+def _quantise_color(color):
+    """ Return an RGB tuple as 8-bit integers; floats in [0, 1] are
+        rounded as for _to_byte()
+    """
+    return tuple(int(value) if isinstance(value, numbers.Integral)
+                 else _to_byte(value) for value in color)
+
+
+@_instrumented("colors")
+def render_swatches(colors, columns=None, cell=8):
+    """Return an image of a palette as a grid of square swatches, as a
+       (height, width, 3) uint8 NumPy array of RGB pixels. Requires NumPy.
+
+       Swatches are placed in rows from the top left, and any cells left
+       over in the last row are white. The image is built from the whole
+       palette at once, so the time taken depends on the number of pixels
+       rather than the number of colours.
+
+       Arguments:
+
+       o colors - a Palette, or an array or iterable of RGB colour tuples
+                  with values in [0, 1]
+
+       o columns - the number of swatches in each row; by default, enough
+                   to make the grid roughly square
+
+       o cell - edge of each swatch, in pixels
+    """
+    _require_numpy("render_swatches()")
+    rgb8 = _rgb8_colors(colors)
+    k = len(rgb8)
+    if columns is None:
+        columns = max(1, int(np.ceil(np.sqrt(k))))
+    rows = max(1, -(-k // columns))
+    grid = np.full((rows * columns, 3), 255, dtype=np.uint8)
+    grid[:k] = rgb8
+    grid = grid.reshape(rows, columns, 3)
+    return np.repeat(np.repeat(grid, cell, axis=0), cell, axis=1)
+
+
+@_instrumented("colors")
+def render_spiral(colors, size=512, radius=3):
+    """Return an image of a palette with each colour drawn as a dot at its
+       position on the HSV colour disc (hue as the angle anticlockwise
+       from the right, saturation as the distance from the centre), as a
+       (size, size, 3) uint8 NumPy array of RGB pixels. Requires NumPy.
+
+       Later colours are drawn over earlier ones, on a white background.
+
+       Arguments:
+
+       o colors - a Palette, or an array or iterable of RGB colour tuples
+                  with values in [0, 1]
+
+       o size - edge of the image, in pixels
+
+       o radius - radius of each dot, in pixels
+    """
+    _require_numpy("render_spiral()")
+    rgb8 = _rgb8_colors(colors)
+    h, s = _rgb_to_hs_array(rgb8 / 255.)
+    centre = (size - 1) / 2.
+    x = np.rint(centre + s * size * 0.45 * np.cos(2 * pi * h)).astype(int)
+    y = np.rint(centre - s * size * 0.45 * np.sin(2 * pi * h)).astype(int)
+    pixels = np.full((size, size, 3), 255, dtype=np.uint8)
+    # One array assignment per pixel of the dot, not per colour
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx * dx + dy * dy > radius * radius:
+                continue
+            px, py = x + dx, y + dy
+            inside = (px >= 0) & (px < size) & (py >= 0) & (py < size)
+            pixels[py[inside], px[inside]] = rgb8[inside]
+    return pixels
+
+
+def save_image(filename, pixels):
+    """Write a (height, width, 3) uint8 array of RGB pixels, such as those
+       from render_swatches() and render_spiral(), to an image file.
+
+       The format is chosen by the extension of filename: '.ppm' (binary
+       portable pixmap), '.png', or '.pdf' (a single page holding the
+       image, one point per pixel). No imaging library is needed.
+
+       Arguments:
+
+       o filename - name of the file to write
+
+       o pixels - the image, as a NumPy array
+    """
+    _require_numpy("save_image()")
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    if pixels.ndim != 3 or pixels.shape[2] != 3:
+        raise ValueError("pixels must have shape (height, width, 3), got "
+                         "%r" % (pixels.shape,))
+    height, width = pixels.shape[:2]
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".ppm":
+        data = b"P6\n%d %d\n255\n" % (width, height) + pixels.tobytes()
+    elif ext == ".png":
+        data = _png_bytes(pixels)
+    elif ext == ".pdf":
+        data = _pdf_bytes(pixels)
+    else:
+        raise ValueError("Unsupported image format %r; use .ppm, .png or "
+                         ".pdf" % ext)
+    with open(filename, "wb") as handle:
+        handle.write(data)
+
+
+def _rgb8_colors(colors):
+    """ Return the colours of a Palette, or of an array or iterable of RGB
+        float tuples, as an (n, 3) uint8 array
+    """
+    if isinstance(colors, Palette):
+        return colors.to_rgb8().to_array()
+    colors = np.asarray(list(colors) if not hasattr(colors, "shape")
+                        else colors, dtype=float)
+    return _rgb8_array(colors.reshape(-1, 3))
+
+
+def _rgb_to_hs_array(rgb):
+    """ Vectorised hue and saturation of colorsys.rgb_to_hsv(), for an
+        (n, 3) array of RGB values
+    """
+    maxc, minc = rgb.max(axis=1), rgb.min(axis=1)
+    delta = maxc - minc
+    grey = delta == 0
+    s = np.where(maxc > 0, delta / np.where(maxc > 0, maxc, 1), 0.)
+    delta = np.where(grey, 1, delta)
+    r, g, b = [(maxc - rgb[:, i]) / delta for i in range(3)]
+    h = np.where(rgb[:, 0] == maxc, b - g,
+                 np.where(rgb[:, 1] == maxc, 2.0 + r - b, 4.0 + g - r))
+    h = np.where(grey, 0., (h / 6.0) % 1.0)
+    return h, s
+
+
+def _png_bytes(pixels):
+    """ Encode a (height, width, 3) uint8 array as an RGB PNG image """
+    height, width = pixels.shape[:2]
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data +
+                struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    # Each row is preceded by its filter type, 0 (none)
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * 3)
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2,
+                                       0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+
+def _pdf_bytes(pixels):
+    """ Encode a (height, width, 3) uint8 array as a one-page PDF holding
+        the image as a single image object
+    """
+    height, width = pixels.shape[:2]
+    image = zlib.compress(pixels.tobytes(), 6)
+    content = b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (width, height)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+        b"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>" %
+        (width, height),
+        b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+        b"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+        b"/Length %d >>\nstream\n%s\nendstream" %
+        (width, height, len(image), image),
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+    ]
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += (b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+             % (len(objects) + 1, xref))
+    return data
+
+
+# Header of palette files written by save_palette(): magic string, format
+# version, array typecode and byte order of the colour data, whether the
+# palette has jitter from a seed, spiral parameters a, b, v_init, v_final,
+# jitter and offset, the tolerance and offset of the lookup table the
+# palette was interpolated from (both 0 if it was calculated directly),
+# the seed's stream key, and k. The colour data follows immediately,
+# aligned to eight bytes.
+_STORE_MAGIC = b"CSPALETT"
+_STORE_VERSION = 2
+_STORE_HEADER = struct.Struct("<8sHccB8dQq3x")
+
+
+def save_palette(filename, cspiral, k, offset=0.1, typecode='d'):
+    """Write the palette of k colours from the ColorSpiral cspiral to
+       filename, with its spiral parameters, for load_palette().
+
+       The file is written to a temporary file and then renamed, so that
+       processes reading filename never see a partly-written palette.
+       Palettes with jitter can only be saved if the ColorSpiral has an
+       integer seed.
+
+       Arguments:
+
+       o filename - path of the palette file
+
+       o cspiral - ColorSpiral object generating the palette
+
+       o k - the number of colours in the palette
+
+       o offset - how far along the spiral path to start.
+
+       o typecode - 'd' or 'f' to hold colours as double or single
+                    precision floats, or 'B' for 8-bit integers
+    """
+    header = _store_header(cspiral, k, offset, typecode)
+    palette = cspiral.get_palette(k, offset, typecode)
+    handle, tmpname = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)),
+        prefix=".%s." % os.path.basename(filename))
+    try:
+        with os.fdopen(handle, "wb") as outfile:
+            outfile.write(header)
+            outfile.write(palette.buffer)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def load_palette(filename):
+    """Return the palette saved in filename by save_palette(), as a
+       read-only Palette backed by a memory map of the file.
+
+       The colours are not copied into memory, so processes loading the
+       same file share one copy of it through the operating system's page
+       cache. Raises ValueError if filename is not a palette file.
+    """
+    with open(filename, "rb") as handle:
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    fields = _read_store_header(data)
+    return Palette(memoryview(data)[_STORE_HEADER.size:], fields[2])
+
+
+def open_palette(filename, cspiral, k, offset=0.1, typecode='d'):
+    """Return the palette of k colours from the ColorSpiral cspiral, as a
+       Palette backed by a memory map of filename, as for load_palette().
+
+       If filename does not exist, or holds a palette for different spiral
+       parameters, k, offset or typecode, the palette is generated and
+       saved to filename first, as for save_palette().
+
+       Arguments:
+
+       o filename - path of the palette file
+
+       o cspiral - ColorSpiral object generating the palette
+
+       o k - the number of colours in the palette
+
+       o offset - how far along the spiral path to start.
+
+       o typecode - 'd' or 'f' to hold colours as double or single
+                    precision floats, or 'B' for 8-bit integers
+    """
+    header = _store_header(cspiral, k, offset, typecode)
+    try:
+        with open(filename, "rb") as handle:
+            if handle.read(_STORE_HEADER.size) == header:
+                return load_palette(filename)
+    except (IOError, OSError, ValueError):
+        pass
+    save_palette(filename, cspiral, k, offset, typecode)
+    return load_palette(filename)
+
+
+def _store_header(cspiral, k, offset, typecode):
+    """Return the palette file header for the palette of k colours from
+       cspiral
+    """
+    if cspiral._cache_key(k, offset) is None:
+        raise ValueError("Palettes with jitter can only be saved if the "
+                         "ColorSpiral has an integer seed")
+    if typecode not in ('d', 'f', 'B'):
+        raise ValueError("typecode must be 'd', 'f' or 'B', not %r" %
+                         typecode)
+    seeded = bool(cspiral.jitter)
+    lut = cspiral._lut
+    if lut is None or not lut.covers(offset):
+        lut_tolerance, lut_offset = 0, 0
+    else:
+        lut_tolerance, lut_offset = lut.tolerance, lut.offset
+    return _STORE_HEADER.pack(
+        _STORE_MAGIC, _STORE_VERSION, typecode.encode("ascii"),
+        sys.byteorder[0].encode("ascii"), seeded, cspiral.a, cspiral.b,
+        cspiral.v_init, cspiral.v_final, cspiral.jitter, offset,
+        lut_tolerance, lut_offset, cspiral._seed_key if seeded else 0, k)
+
+
+def _read_store_header(data):
+    """Return the fields of the palette file header at the start of data,
+       with the typecode decoded, raising ValueError if it is not valid
+    """
+    if len(data) < _STORE_HEADER.size:
+        raise ValueError("Not a palette file: too short")
+    fields = list(_STORE_HEADER.unpack_from(data))
+    if fields[0] != _STORE_MAGIC:
+        raise ValueError("Not a palette file: bad magic string")
+    if fields[1] != _STORE_VERSION:
+        raise ValueError("Unsupported palette file version %d" % fields[1])
+    fields[2] = fields[2].decode("ascii")
+    if fields[3].decode("ascii") != sys.byteorder[0]:
+        raise ValueError("Palette file has the wrong byte order")
+    itemsize = array(fields[2]).itemsize
+    if len(data) - _STORE_HEADER.size != fields[-1] * 3 * itemsize:
+        raise ValueError("Palette file is truncated")
+    return fields
+
+
+class PaletteCache(object):
+    """Least-recently-used cache of palettes, keyed on spiral parameters.
+
+       Palettes are stored as immutable Palette objects. The cache may
+       be bounded by the number of palettes it holds, by their total size
+       in bytes, or both; the least recently used palettes are
+       evicted first when either bound is exceeded. A maxsize of zero
+       disables caching.
+
+       The module-level get_colors() and get_color_dict() helpers use the
+       palette_cache instance of this class. Palettes with jitter are only
+       cached when the ColorSpiral has an integer seed, so that cached and
+       uncached palettes are always identical.
+    """
+    def __init__(self, maxsize=128, maxbytes=None):
+        """Initialise an empty palette cache
+
+           Arguments:
+
+           o maxsize - maximum number of palettes to hold, or None for no
+                       limit
+
+           o maxbytes - maximum total size of palettes held, in bytes, or
+                        None for no limit
+        """
+        self._palettes = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cspiral, k, offset=0.1):
+        """Return the Palette of k colours from the ColorSpiral cspiral,
+           generating it if it is not cached.
+
+           Arguments:
+
+           o cspiral - ColorSpiral object generating the palette, or a
+                       SpiralSpec describing it
+
+           o k - the number of colours in the palette
+
+           o offset - how far along the spiral path to start.
+        """
+        key = cspiral._cache_key(k, offset)
+        if key is None or self.maxsize == 0:
+            return self._generate(cspiral, k, offset)
+        with self._lock:
+            palette = self._palettes.get(key)
+            if palette is not None:
+                self._palettes.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if _metrics is not None:
+            _metrics.record_cache(palette is not None, k)
+        if palette is not None:
+            return palette
+        # Generate outside the lock, so that other palettes can be served
+        # in the meantime
+        palette = self._generate(cspiral, k, offset)
+        with self._lock:
+            if key not in self._palettes:
+                self._palettes[key] = palette
+                self._nbytes += palette.nbytes
+                self._evict()
+        return palette
+
+    def clear(self):
+        """Remove all palettes from the cache, and reset statistics"""
+        with self._lock:
+            self._palettes.clear()
+            self._nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def resize(self, maxsize=128, maxbytes=None):
+        """Change the bounds on the cache, evicting palettes as necessary"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.maxbytes = maxbytes
+            self._evict()
+
+    def info(self):
+        """Return a dictionary of cache statistics"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "currsize": len(self._palettes), "nbytes": self._nbytes,
+                    "maxsize": self.maxsize, "maxbytes": self.maxbytes}
+
+    def _generate(self, cspiral, k, offset):
+        """Return the Palette of k colours from a ColorSpiral or SpiralSpec"""
+        if isinstance(cspiral, SpiralSpec):
+            cspiral = cspiral.spiral()
+        return Palette.from_colors(cspiral.get_colors(k, offset))
+
+    def _evict(self):
+        """Evict least recently used palettes until within bounds"""
+        while self._palettes and (
+                (self.maxsize is not None and
+                 len(self._palettes) > self.maxsize) or
+                (self.maxbytes is not None and self._nbytes > self.maxbytes)):
+            _, palette = self._palettes.popitem(last=False)
+            self._nbytes -= palette.nbytes
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._palettes)
+
+
+# Palette cache used by the convenience functions, holding at most 128
+# palettes and 256 MiB of colours
+palette_cache = PaletteCache(maxsize=128, maxbytes=2**28)
+
+
+class Metrics(object):
+    """Counters and timing histograms of palette generation calls.
+
+       While enabled by enable_metrics() or collect_metrics(), each call of
+       the main colour generating and converting functions and methods is
+       recorded under its name (such as "get_colors" or
+       "ColorSpiral.get_colors_array") and a bucket of the number of
+       colours k: the smallest power of ten that is at least k, or None if
+       k is not known. Each record counts the calls, their total and
+       longest times, and a histogram of their times in decades from 1 us
+       to 10 s. Times of functions returning iterators include the time
+       taken to consume them, and times include those of any instrumented
+       calls made in turn. Palette cache hits and misses are counted by
+       the same buckets of k.
+    """
+    # Upper bounds, in seconds, of the timing histogram bins; a final bin
+    # counts longer calls
+    TIME_BINS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0, 10.0)
+
+    def __init__(self, hook=None):
+        """Initialise empty metrics
+
+           Arguments:
+
+           o hook - function to export metrics as they are recorded, called
+                    as hook(name, k, seconds) after each call. Cache hits
+                    and misses are reported with names "cache_hit" and
+                    "cache_miss", and seconds of None.
+        """
+        self.hook = hook
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = {}
+
+    def record(self, name, k, seconds):
+        """Record a call of name for k colours, taking seconds"""
+        key = (name, _k_bucket(k))
+        slot = bisect_left(self.TIME_BINS, seconds)
+        with self._lock:
+            stats = self._calls.get(key)
+            if stats is None:
+                stats = self._calls[key] = {
+                    "count": 0, "total": 0.0, "max": 0.0,
+                    "histogram": [0] * (len(self.TIME_BINS) + 1)}
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["histogram"][slot] += 1
+        if self.hook is not None:
+            self.hook(name, k, seconds)
+
+    def record_cache(self, hit, k):
+        """Record a palette cache hit (if hit is True) or miss for k
+           colours
+        """
+        bucket = _k_bucket(k)
+        with self._lock:
+            stats = self._cache.get(bucket)
+            if stats is None:
+                stats = self._cache[bucket] = {"hits": 0, "misses": 0}
+            stats["hits" if hit else "misses"] += 1
+        if self.hook is not None:
+            self.hook("cache_hit" if hit else "cache_miss", k, None)
+
+    def snapshot(self):
+        """Return a copy of the metrics recorded so far, as a dictionary:
+           "calls" maps (name, k bucket) tuples to dictionaries of the
+           call "count", "total" and "max" times, and "histogram" (counts
+           of calls in the bins of TIME_BINS); "cache" maps k buckets to
+           dictionaries of "hits" and "misses".
+        """
+        with self._lock:
+            calls = dict((key, dict(stats, histogram=list(stats["histogram"])))
+                         for key, stats in self._calls.items())
+            cache = dict((bucket, dict(stats))
+                         for bucket, stats in self._cache.items())
+        return {"calls": calls, "cache": cache}
+
+    def reset(self):
+        """Discard all metrics recorded so far"""
+        with self._lock:
+            self._calls.clear()
+            self._cache.clear()
+
+
+def enable_metrics(metrics=None, hook=None):
+    """Start recording metrics of palette generation, returning the Metrics
+       object they are recorded in.
+
+       Arguments:
+
+       o metrics - Metrics object to record in; by default, a new one
+
+       o hook - export function for a new Metrics object, as for Metrics
+    """
+    global _metrics
+    if metrics is None:
+        metrics = Metrics(hook)
+    _metrics = metrics
+    return metrics
+
+
+def disable_metrics():
+    """Stop recording metrics, returning the Metrics object that was in
+       use, or None
+    """
+    global _metrics
+    metrics, _metrics = _metrics, None
+    return metrics
+
+
+@contextlib.contextmanager
+def collect_metrics(metrics=None, hook=None):
+    """Context manager recording metrics of palette generation within a
+       with block, as by enable_metrics(), and yielding the Metrics object.
+       Whatever recording was in effect before is restored afterwards.
+    """
+    global _metrics
+    previous = _metrics
+    metrics = enable_metrics(metrics, hook)
+    try:
+        yield metrics
+    finally:
+        _metrics = previous
+
+
+def _k_bucket(k):
+    """ Return the smallest power of ten at least k, or None if k is not
+        known; k may be a number of colours, or a sized collection of them
+    """
+    if not isinstance(k, numbers.Integral):
+        try:
+            k = len(k)
+        except TypeError:
+            return None
+    bucket = 1
+    while bucket < k:
+        bucket *= 10
+    return bucket
+
+
+class PaletteServer(object):
+    """Asyncio server of palettes and colour dictionaries, for processes
+       that cannot import this module, or would otherwise pay for starting
+       Python and generating palettes on every request.
+
+       The protocol is JSON lines: each request is a JSON object on one
+       line, and the server answers each with a JSON object on one line,
+       in the order the requests were made on the connection. Requests may
+       be sent without waiting for earlier answers. Requests have keys:
+
+       o op - "palette" (the default) for a list of k colours, as from
+              get_colors(), or "dict" for a dictionary colouring a list of
+              keys, as from get_color_dict()
+
+       o k - the number of colours, for "palette", at most max_k
+
+       o keys - list of the keys to colour, for "dict", at most max_k
+
+       o offset, fmt - as for get_colors(); by default 0.1 and "float".
+                       "packed" and "hex" give the most compact answers.
+
+       o params - dictionary of ColorSpiral arguments (a, b, v_init,
+                  v_final, jitter and an integer seed)
+
+       o id - any JSON value, returned with the answer
+
+       Answers have "colors", holding the list or dictionary of colours,
+       or "error", holding a message; and "id", if the request had one.
+
+       Requests for a palette that is already being calculated wait for
+       that calculation rather than repeating it. Palettes of up to small_k
+       colours requested within batch_delay seconds of each other (by
+       default, in the same iteration of the event loop) are calculated
+       together, in one job in a worker thread; larger ones each have their
+       own job. Palettes are kept warm in a PaletteCache, and
+       the encoded answers for the most recently used palettes are kept
+       too. Palettes with jitter from an unseeded stream are calculated
+       afresh for each request.
+    """
+    def __init__(self, cache=None, small_k=4096, batch_delay=0,
+                 maxencoded=256, max_k=10 ** 6):
+        """Initialise a server, which is started by start()
+
+           Arguments:
+
+           o cache - PaletteCache to keep palettes in; by default,
+                     palette_cache
+
+           o small_k - the largest palette calculated in a batch
+
+           o batch_delay - time in seconds to collect a batch of small
+                           palette requests for
+
+           o maxencoded - the number of encoded palette answers to keep
+
+           o max_k - the largest palette served; requests for more colours
+                     are answered with an error
+        """
+        self.cache = palette_cache if cache is None else cache
+        self.small_k = small_k
+        self.batch_delay = batch_delay
+        self.maxencoded = maxencoded
+        self.max_k = max_k
+        self.stats = {"requests": 0, "errors": 0, "coalesced": 0,
+                      "warm": 0, "jobs": 0}
+        self._encoded = OrderedDict()
+        self._inflight = {}
+        self._batch = []
+        self._server = None
+
+    async def start(self, address="127.0.0.1:8765"):
+        """Start serving at address, a "host:port" string for TCP, or the
+           path of a Unix socket. Returns the server.
+        """
+        path, host, port = _split_address(address)
+        if path is not None:
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=path, limit=_SERVER_LINE_LIMIT)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, host, port, limit=_SERVER_LINE_LIMIT)
+        return self
+
+    @property
+    def address(self):
+        """The address being served, in the form taken by start()"""
+        name = self._server.sockets[0].getsockname()
+        if isinstance(name, str):
+            return name
+        return "%s:%d" % name[:2]
+
+    async def serve_forever(self):
+        """Serve requests until cancelled"""
+        await self._server.serve_forever()
+
+    def close(self):
+        """Stop accepting connections"""
+        self._server.close()
+
+    async def wait_closed(self):
+        """Wait until the server is closed"""
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        """Answer the requests on a connection, in order"""
+        answers = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send(answers, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    answers.put_nowait(asyncio.ensure_future(
+                        self._answer(line)))
+        except (ConnectionError, ValueError):
+            # ValueError: a line longer than the stream limit
+            pass
+        finally:
+            answers.put_nowait(None)
+            await sender
+            writer.close()
+
+    async def _send(self, answers, writer):
+        """Write answers to a connection as they are ready, in order"""
+        while True:
+            answer = await answers.get()
+            if answer is None:
+                break
+            try:
+                writer.write(await answer)
+                await writer.drain()
+            except ConnectionError:
+                answer.cancel()
+
+    async def _answer(self, line):
+        """Return the encoded answer to a request line"""
+        self.stats["requests"] += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            request_id = request.get("id")
+            body = b'"colors": ' + await self._colors(request)
+        except Exception as err:
+            # Any failure is answered, rather than ending the connection
+            # with later requests unanswered
+            self.stats["errors"] += 1
+            body = b'"error": ' + json.dumps(
+                "%s: %s" % (type(err).__name__, err)).encode()
+        if request_id is None:
+            return b"{" + body + b"}\n"
+        return (b'{"id": ' + json.dumps(request_id).encode() + b", " +
+                body + b"}\n")
+
+    async def _colors(self, request):
+        """Return the encoded colours answering a request"""
+        op = request.get("op", "palette")
+        fmt = request.get("fmt", "float")
+        _check_format(fmt)
+        offset = float(request.get("offset", 0.1))
+        spec = SpiralSpec(**request.get("params", {}))
+        if spec.seed is not None and not isinstance(spec.seed, int):
+            raise TypeError("seed must be an integer")
+        if op == "dict":
+            keys = request["keys"]
+            if not isinstance(keys, list):
+                raise TypeError("keys must be a list")
+            self._check_k(len(keys))
+            palette = await self._palette(spec, len(keys), offset)
+            return json.dumps(dict(zip(keys, _palette_colors(palette, fmt))),
+                              separators=(",", ":")).encode()
+        if op != "palette":
+            raise ValueError("unknown op %r" % op)
+        k = request["k"]
+        if not isinstance(k, int) or k < 0:
+            raise ValueError("k must be a non-negative integer")
+        self._check_k(k)
+        key = spec._cache_key(k, offset)
+        if key is not None:
+            encoded = self._encoded.get((key, fmt))
+            if encoded is not None:
+                self._encoded.move_to_end((key, fmt))
+                self.stats["warm"] += 1
+                return encoded
+        palette = await self._palette(spec, k, offset)
+        if k > self.small_k:
+            encoded = await asyncio.get_running_loop().run_in_executor(
+                None, _encode_colors, palette, fmt)
+        else:
+            encoded = _encode_colors(palette, fmt)
+        if key is not None and self.maxencoded:
+            self._encoded[(key, fmt)] = encoded
+            while len(self._encoded) > self.maxencoded:
+                self._encoded.popitem(last=False)
+        return encoded
+
+    def _check_k(self, k):
+        """Raise ValueError if a palette of k colours is too large to serve
+        """
+        if k > self.max_k:
+            raise ValueError("at most %d colours may be requested, not %d" %
+                             (self.max_k, k))
+
+    async def _palette(self, spec, k, offset):
+        """Return the Palette of k colours, joining any calculation of it
+           already in progress, or adding it to the next batch
+        """
+        key = spec._cache_key(k, offset)
+        future = self._inflight.get(key) if key is not None else None
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            if key is not None:
+                self._inflight[key] = future
+            job = (spec, k, offset, key, future)
+            if k > self.small_k:
+                self._run_jobs([job])
+            else:
+                self._batch.append(job)
+                if len(self._batch) == 1:
+                    loop.call_later(self.batch_delay, self._flush)
+        # Shielded, so that one request being cancelled does not cancel
+        # the calculation for the others waiting on it
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        """Calculate the batch of small palettes"""
+        jobs, self._batch = self._batch, []
+        self._run_jobs(jobs)
+
+    def _run_jobs(self, jobs):
+        """Calculate palettes in a worker thread, then finish their jobs"""
+        self.stats["jobs"] += 1
+        result = asyncio.get_running_loop().run_in_executor(
+            None, self._calculate, jobs)
+        result.add_done_callback(lambda result: self._finish(jobs, result))
+
+    def _calculate(self, jobs):
+        """Return a list of (palette, error) for the jobs; run in a worker
+           thread
+        """
+        results = []
+        for spec, k, offset, _, _ in jobs:
+            try:
+                results.append((self.cache.get(spec, k, offset), None))
+            except Exception as err:
+                results.append((None, err))
+        return results
+
+    def _finish(self, jobs, result):
+        """Pass the results of calculating jobs to their futures"""
+        if result.exception() is not None:
+            results = [(None, result.exception())] * len(jobs)
+        else:
+            results = result.result()
+        for (_, _, _, key, future), (palette, error) in zip(jobs, results):
+            if key is not None:
+                self._inflight.pop(key, None)
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(palette)
+
+
+# Longest request or answer line read by the server and client helpers
+_SERVER_LINE_LIMIT = 2 ** 26
+
+
+def serve_palettes(address="127.0.0.1:8765", **kwargs):
+    """Run a PaletteServer at address until interrupted
+
+       Arguments:
+
+       o address - "host:port" for TCP, or the path of a Unix socket
+
+       o **kwargs - pass-through arguments to the PaletteServer
+    """
+    async def serve():
+        server = await PaletteServer(**kwargs).start(address)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+async def open_palette_connection(address="127.0.0.1:8765"):
+    """Open a connection to a PaletteServer at address, returning a
+       (reader, writer) pair of asyncio streams
+    """
+    path, host, port = _split_address(address)
+    if path is not None:
+        return await asyncio.open_unix_connection(path,
+                                                  limit=_SERVER_LINE_LIMIT)
+    return await asyncio.open_connection(host, port, limit=_SERVER_LINE_LIMIT)
+
+
+def _split_address(address):
+    """ Return (path, host, port) for a "host:port" or Unix socket path
+        address; path is None for TCP, and host and port for Unix sockets
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.sep not in address:
+        return None, host, int(port)
+    return address, None, None
+
+
+def _encode_colors(palette, fmt):
+    """ Return a list of the colours of a Palette in format fmt, encoded
+        as compact JSON
+    """
+    return json.dumps(list(_palette_colors(palette, fmt)),
+                      separators=(",", ":")).encode()
+
+
+# Convenience functions for those who don't want to bother with a
+# ColorSpiral object
+@_instrumented()
+def get_colors(k, offset=0.1, fmt="float", **kwargs):
+    """Returns k colours selected by the ColorSpiral object, as an iterator
+
+       Palettes are held in palette_cache, so repeated calls with the same
+       arguments do not recalculate them. By default the cache holds at
+       most 128 palettes and 256 MiB of colours; use palette_cache.resize()
+       to change this. Palettes that cannot be cached (jitter without an
+       integer seed) are generated lazily, as the iterator is consumed.
+
+       Arguments:
+
+       o k - the number of colours to return
+
+       o offset - how far along the spiral path to start.
+
+       o fmt - output format, as for ColorSpiral.get_colors(). The whole
+               palette is converted at once when it is cached.
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    _check_format(fmt)
+    spec = SpiralSpec(**kwargs)
+    if spec._cache_key(k, offset) is None:
+        # Check the arguments now, rather than when iteration starts
+        cspiral = spec.spiral()
+        cspiral._check_spiral(k, offset)
+        return cspiral.get_colors(k, offset, fmt)
+    return iter(_palette_colors(palette_cache.get(spec, k, offset), fmt))
+
+
+@_instrumented()
+def get_colors_array(k, offset=0.1, workers=1, **kwargs):
+    """Returns k colours selected by the ColorSpiral object, as a (k, 3)
+       NumPy array
+
+       Arguments:
+
+       o k - the number of colours to return
+
+       o offset - how far along the spiral path to start.
+
+       o workers - the number of processes to use, or None for one per CPU
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    cspiral = ColorSpiral(**kwargs)
+    return cspiral.get_colors_array(k, offset, workers)
+
+
+@_instrumented("codes")
+def get_colors_for_codes(codes, k=None, offset=0.1, packed=False, **kwargs):
+    """Returns the colours for an array of integer category codes, as for
+       ColorSpiral.colors_for_codes()
+
+       Arguments:
+
+       o codes - array of integer codes in [0, k), or -1 for missing values,
+                 or a pandas Categorical or pyarrow DictionaryArray
+
+       o k - the number of categories, if not the number of categories of
+             codes, or the largest code plus one
+
+       o offset - how far along the spiral path to start.
+
+       o packed - if True, return a uint32 array of 0xRRGGBB values rather
+                  than an (n, 3) float array
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    cspiral = ColorSpiral(**kwargs)
+    return cspiral.colors_for_codes(codes, k, offset, packed)
+
+
+def get_hashed_color(key, buckets=1024, offset=0.1, fmt="float",
+                     **kwargs):
+    """Returns the colour for key chosen by a stable hash, as for
+       ColorSpiral.color_for_key()
+
+       Arguments:
+
+       o key - str, bytes or int key to colour
+
+       o buckets - the number of distinct colours keys are mapped to
+
+       o offset - how far along the spiral path to start.
+
+       o fmt - output format, as for ColorSpiral.get_colors()
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    _check_format(fmt)
+    cspiral = ColorSpiral(**kwargs)
+    return _format_color(cspiral.color_for_key(key, buckets, offset), fmt)
+
+
+@_instrumented()
+def get_palette(k, offset=0.1, typecode='d', **kwargs):
+    """Returns k colours selected by the ColorSpiral object, as a Palette
+
+       Arguments:
+
+       o k - the number of colours to return
+
+       o offset - how far along the spiral path to start.
+
+       o typecode - 'd' or 'f' to hold colours as double or single
+                    precision floats, or 'B' for 8-bit integers
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    cspiral = ColorSpiral(**kwargs)
+    return cspiral.get_palette(k, offset, typecode)
+
+
+@_instrumented("iterable")
+def get_color_dict(iterable, offset=0.1, cdict=None, stable=False,
+                   fmt="float", k=None, **kwargs):
+    """Returns a dictionary, keyed by the members of iterable l, with a
+       colour assigned to each member.
+
+       Palettes are held in palette_cache, so repeated calls with the same
+       arguments do not recalculate them. By default the cache holds at
+       most 128 palettes and 256 MiB of colours; use palette_cache.resize()
+       to change this.
+
+       Arguments:
+
+       o iterable - an iterable representing classes to be coloured
+
+       o offset - how far along the spiral path to start.
+
+       o cdict - an existing dictionary to add colours to, which is
+                 returned in place of a new dictionary
+
+       o stable - if True, colours are taken in turn from the open-ended
+                  sequence of ColorSpiral.get_stable_colors(), starting
+                  after the len(cdict) colours already assigned. Members of
+                  iterable that are already keys of cdict keep their
+                  colours. This allows a dictionary to be extended with new
+                  classes without changing the colours of existing ones.
+
+       o fmt - output format for the colours, as for
+               ColorSpiral.get_colors()
+
+       o k - the number of members of iterable, if known. This is needed
+             for one-shot iterators, such as generators, unless stable is
+             True; other iterables without a length are counted in a first
+             pass.
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    _check_format(fmt)
+    spec = SpiralSpec(**kwargs)
+    if cdict is None:
+        cdict = {}
+    if stable:
+        colors = _format_colors(
+            spec.spiral().get_stable_colors(None, len(cdict), offset), fmt)
+        for item in iterable:
+            if item not in cdict:
+                cdict[item] = next(colors)
+        return cdict
+    try:
+        size = len(iterable)
+    except TypeError:
+        # Unsized iterables are coloured as a stream
+        if k is None:
+            k = _count_members(iterable)
+        cdict.update(_iter_color_items(spec.spiral(), iterable, k, offset,
+                                       fmt))
+        return cdict
+    if k is None:
+        k = size
+    elif size > k:
+        raise ValueError("iterable has more than k=%d members" % k)
+    colors = palette_cache.get(spec, k, offset)
+    for item, color in zip(iterable, _palette_colors(colors, fmt)):
+        cdict[item] = color
+    return cdict
+
+
+@_instrumented("iterable", lazy=True)
+def iter_color_items(iterable, k=None, offset=0.1, stable=False, fmt="float",
+                     **kwargs):
+    """Returns an iterator of (member, colour) tuples, with a colour
+       assigned to each member of iterable, as for get_color_dict().
+
+       Colours are generated lazily, as iterable is consumed, so this may
+       be used to colour streams of classes that are too large to hold in
+       memory. The number of colours to space along the spiral is taken
+       from k if given, otherwise from len(iterable). If iterable has no
+       length, it is counted in a first pass, and iterated over again in a
+       second; this is not possible for one-shot iterators, such as
+       generators, which need k or stable=True.
+
+       Arguments:
+
+       o iterable - an iterable representing classes to be coloured
+
+       o k - the number of members of iterable, if known
+
+       o offset - how far along the spiral path to start.
+
+       o stable - if True, colours are taken in turn from the open-ended
+                  sequence of ColorSpiral.get_stable_colors(), and k is not
+                  needed
+
+       o fmt - output format for the colours, as for
+               ColorSpiral.get_colors()
+
+       o **kwargs - pass-through arguments to the ColorSpiral object
+    """
+    _check_format(fmt)
+    cspiral = ColorSpiral(**kwargs)
+    if stable:
+        return zip(iterable, _format_colors(
+            cspiral.get_stable_colors(None, 0, offset), fmt))
+    if k is None:
+        k = _count_members(iterable)
+    return _iter_color_items(cspiral, iterable, k, offset, fmt)
+
+
+def _count_members(iterable):
+    """Return the number of members of iterable, counting them in a first
+       pass if it has no length
+    """
+    try:
+        return len(iterable)
+    except TypeError:
+        if iter(iterable) is iterable:
+            raise TypeError("Cannot count the members of a one-shot "
+                            "iterator; give k, or use stable=True")
+        return sum(1 for _ in iterable)
+
+
+def _iter_color_items(cspiral, iterable, k, offset, fmt="float"):
+    """Generator of (member, colour) tuples for iter_color_items()"""
+    colors = cspiral.get_colors(k, offset, fmt)
+    for item in iterable:
+        try:
+            color = next(colors)
+        except StopIteration:
+            raise ValueError("iterable has more than k=%d members" % k)
+        yield item, color
+
+
+# Formats written by main(): raw little-endian float32 or uint8 RGB
+# triples, or lines of comma-separated floats, JSON arrays of floats, or
+# '#rrggbb' strings. Text floats are written in full precision, as by
+# repr(), unless a number of decimal places is given, and the integer
+# formats are rounded as by _to_byte().
+_EXPORT_FORMATS = ("f32", "u8", "csv", "ndjson", "hex")
+
+# Line templates for the text export formats, without and with a leading
+# category
+_EXPORT_LINES = {"csv": ("%r,%r,%r\n", "%s,%r,%r,%r\n"),
+                 "ndjson": ("[%r,%r,%r]\n",
+                            '{"category":%s,"color":[%r,%r,%r]}\n'),
+                 "hex": ("#%06x\n", "%s,#%06x\n")}
+
+
+def _export_chunks(cspiral, k, chunk_size, offset):
+    """ Return an iterator of the k colours of cspiral in chunks of up to
+        chunk_size, as (n, 3) NumPy arrays in a reused buffer, or without
+        NumPy as lists of RGB float tuples
+    """
+    if np is not None:
+        return cspiral.iter_color_chunks(k, chunk_size, offset,
+                                         np.empty((chunk_size, 3)))
+    colors = cspiral.get_colors(k, offset)
+    return iter(lambda: list(islice(colors, chunk_size)), [])
+
+
+def _export_bytes(colors, fmt, categories=None, digits=None):
+    """ Return colors, an (n, 3) NumPy array or a list of RGB float
+        tuples, encoded in the export format fmt. Lines of the text formats
+        start with the matching member of the list categories, if given,
+        and floats are written with digits decimal places, if given.
+    """
+    if fmt == "f32":
+        if np is not None:
+            return colors.astype("<f4").tobytes()
+        data = array("f", chain.from_iterable(colors))
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data.tobytes()
+    if fmt == "u8":
+        if np is not None:
+            return _rgb8_array(colors).tobytes()
+        return bytes(_to_byte(x) for x in chain.from_iterable(colors))
+    if fmt == "hex":
+        if np is not None:
+            values = _pack_rgb8(_rgb8_array(colors)).tolist()
+        else:
+            values = [_format_color(color, "packed") for color in colors]
+        width = 1
+    else:
+        if np is not None:
+            values = colors.ravel().tolist()
+        else:
+            values = list(chain.from_iterable(colors))
+        width = 3
+    # One formatting operation per chunk, rather than one per line
+    plain, categorised = _EXPORT_LINES[fmt]
+    if digits is not None and fmt != "hex":
+        if np is not None and categories is None:
+            return _fixed_point_bytes(colors, digits, plain)
+        plain = plain.replace("%r", "%%.%df" % digits)
+        categorised = categorised.replace("%r", "%%.%df" % digits)
+        # Clamped as by _fixed_point_bytes(); adding 0.0 turns -0.0 into
+        # 0.0, which is not written with a sign
+        values = [min(max(x, 0.0), 1.0) + 0.0 for x in values]
+    if categories is None:
+        return ((plain * (len(values) // width)) % tuple(values)).encode()
+    quote = json.dumps if fmt == "ndjson" else _csv_field
+    fields = []
+    for i, category in enumerate(categories):
+        fields.append(quote(category))
+        fields.extend(values[i * width:(i + 1) * width])
+    return ((categorised * len(categories)) % tuple(fields)).encode()
+
+
+def _fixed_point_bytes(colors, digits, template):
+    """ Return the (n, 3) NumPy array colors as lines of text following
+        template, with values in [0, 1] written to digits decimal places
+        (between 1 and 15) digit by digit for all lines at once, rather
+        than formatted one by one. Values are correctly rounded to up to 9
+        places; beyond that, the last digit may be one out, as the scaled
+        values are themselves rounded.
+    """
+    line = (template % ((0.,) * 3)).replace("0.0", "0." + "0" * digits)
+    out = np.empty((len(colors), len(line)), dtype=np.uint8)
+    out[:] = np.frombuffer(line.encode(), dtype=np.uint8)
+    scaled = np.rint(np.clip(colors, 0, 1) * 10 ** digits).astype(np.int64)
+    # The decimal places, in groups of three, looked up as ASCII digits
+    groups = (digits + 2) // 3
+    powers = 10 ** np.arange(3 * groups - 3, -1, -3, dtype=np.int64)
+    triples = np.arange(1000)
+    triples = (np.stack([triples // 100, triples // 10 % 10, triples % 10],
+                        axis=1) + 48).astype(np.uint8)  # ord("0") is 48
+    places = triples.take((scaled[..., None] // powers) % 1000, axis=0)
+    # Each value, and the separator after it
+    start = line.index("0.")
+    fields = out[:, start:start + 3 * (digits + 3)].reshape(-1, 3, digits + 3)
+    fields[:, :, 0] += (scaled // 10 ** digits).astype(np.uint8)
+    fields[:, :, 2:digits + 2] = places.reshape(len(colors), 3, -1)[
+        :, :, 3 * groups - digits:]
+    return out.tobytes()
+
+
+def _csv_field(text):
+    """ Return text quoted as a CSV field, if it needs to be """
+    if any(c in text for c in ',"\r\n'):
+        return '"%s"' % text.replace('"', '""')
+    return text
+
+
+def _read_categories(filename):
+    """ Return the list of distinct categories, one per line, in order of
+        first appearance, of the file filename ("-" for standard input)
+    """
+    if filename == "-":
+        lines = sys.stdin
+    else:
+        lines = open(filename)
+    with lines:
+        return list(dict.fromkeys(line.rstrip("\r\n") for line in lines
+                                  if line.strip()))
+
+
+def main(argv=None):
+    """Write colours along a spiral to standard output or a file, from the
+       command line; run python -m ColorSpiral --help for usage. Returns
+       the exit status.
+
+       Colours are calculated and written a chunk at a time, so memory use
+       is bounded by the chunk size rather than the number of colours.
+
+       Arguments:
+
+       o argv - list of command line arguments; by default, sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m ColorSpiral",
+        description="Write k colours spaced along a spiral in HSV space, "
+        "or one colour for each distinct category (line) of a file.")
+    parser.add_argument("k", type=int, nargs="?",
+                        help="number of colours to write")
+    parser.add_argument("-c", "--categories", metavar="FILE",
+                        help="file of categories to colour, one per line "
+                        "(- for standard input); text formats start each "
+                        "line with the category")
+    parser.add_argument("-f", "--format", choices=_EXPORT_FORMATS,
+                        default="csv",
+                        help="raw little-endian float32 or uint8 RGB values, "
+                        "or lines of CSV, JSON or '#rrggbb' (default: csv)")
+    parser.add_argument("-d", "--digits", type=int, metavar="N",
+                        help="write floats in text formats to N decimal "
+                        "places (1 to 15), which is much faster than the "
+                        "default full precision")
+    parser.add_argument("-o", "--output", default="-", metavar="FILE",
+                        help="file to write to (default: standard output)")
+    parser.add_argument("-a", type=float, default=1,
+                        help="spiral parameter a (default: 1)")
+    parser.add_argument("-b", type=float, default=0.33,
+                        help="spiral parameter b (default: 0.33)")
+    parser.add_argument("--v-init", type=float, default=0.85,
+                        help="initial value of brightness (default: 0.85)")
+    parser.add_argument("--v-final", type=float, default=0.5,
+                        help="final value of brightness (default: 0.5)")
+    parser.add_argument("--jitter", type=float, default=0.05,
+                        help="random brightness jitter (default: 0.05)")
+    parser.add_argument("--seed", type=int,
+                        help="seed for reproducible jitter")
+    parser.add_argument("--offset", type=float, default=0.1,
+                        help="how far along the spiral to start "
+                        "(default: 0.1)")
+    parser.add_argument("--chunk-size", type=int, default=65536,
+                        help="number of colours written at a time "
+                        "(default: 65536)")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="instead, run a PaletteServer at ADDRESS "
+                        "(host:port, or a Unix socket path)")
+    args = parser.parse_args(argv)
+    if args.serve is not None:
+        serve_palettes(args.serve)
+        return 0
+    if (args.k is None) == (args.categories is None):
+        parser.error("give one of k or --categories")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    if args.digits is not None and not 1 <= args.digits <= 15:
+        parser.error("--digits must be between 1 and 15")
+    categories = None
+    k = args.k
+    if args.categories is not None:
+        categories = _read_categories(args.categories)
+        k = len(categories)
+    cspiral = ColorSpiral(a=args.a, b=args.b, v_init=args.v_init,
+                          v_final=args.v_final, jitter=args.jitter,
+                          seed=args.seed)
+    try:
+        cspiral._check_spiral(k, args.offset)
+    except (ValueError, AssertionError) as err:
+        parser.error(str(err))
+    chunks = _export_chunks(cspiral, k, args.chunk_size, args.offset)
+    if args.format in ("f32", "u8"):
+        categories = None
+    if args.output == "-":
+        handle = sys.stdout.buffer
+    else:
+        handle = open(args.output, "wb", buffering=2 ** 20)
+    try:
+        start = 0
+        for chunk in chunks:
+            handle.write(_export_bytes(
+                chunk, args.format,
+                None if categories is None else
+                categories[start:start + len(chunk)], args.digits))
+            start += len(chunk)
+        handle.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. piped to head); point standard
+        # output at devnull, so that Python does not fail flushing it
+        # again at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), handle.fileno())
+        return 1
+    finally:
+        if handle is not sys.stdout.buffer:
+            handle.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
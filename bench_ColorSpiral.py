@@ -0,0 +1,632 @@
+#!/usr/bin/env python
+#
+# (c) The James Hutton Institute 2013
+# Author: Leighton Pritchard
+#
+# Contact:
+# leighton.pritchard@hutton.ac.uk
+#
+# Leighton Pritchard,
+# Information and Computing Sciences,
+# James Hutton Institute,
+# Errol Road,
+# Invergowrie,
+# Dundee,
+# DD6 9LH,
+# Scotland,
+# UK
+#
+# The MIT License
+#
+# Copyright (c) 2010-2014 The James Hutton Institute
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+""" Benchmarks for the ColorSpiral utility
+
+Run as a script to measure the throughput, per-colour latency and peak
+memory use of the palette API across k, spiral parameters and jitter
+modes, print a table of results, and save them as JSON:
+
+    python bench_ColorSpiral.py --max-k 1000000 --output results.json
+
+Results from two runs (for instance, from two versions of ColorSpiral)
+can be compared, reporting any benchmark that has become slower:
+
+    python bench_ColorSpiral.py --compare baseline.json --output new.json
+
+Use --extra to also run the hue wrapping, pure Python, parallel scaling,
+rendering, construction, lookup table and metrics benchmarks. Use
+--load-test to measure the latency and throughput of a palette server,
+either one already running at ADDRESS, or one started for the test:
+
+    python bench_ColorSpiral.py --max-k 0 --load-test 127.0.0.1:8765
+
+The test_* functions check the suite itself with small k, and are run by:
+
+    python -m pytest bench_ColorSpiral.py
+"""
+
+# Builtins
+import argparse
+import asyncio
+import colorsys
+import contextlib
+import json
+from math import log, exp, floor, pi
+import os
+import pickle
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ColorSpiral import ColorSpiral, get_color_dict, palette_cache, np, \
+    render_swatches, save_image, SpiralSpec, collect_metrics, get_colors, \
+    open_palette_connection
+
+# Values of k for the benchmark suite, and the largest k for which
+# dictionaries are generated
+SUITE_KS = (10, 1000, 10 ** 5, 10 ** 7)
+MAX_DICT_K = 10 ** 6
+
+# Spiral parameters for the benchmark suite
+SUITE_SPIRALS = (("default", {}),
+                 ("no jitter", {"jitter": 0}),
+                 ("seeded jitter", {"jitter": 0.05, "seed": 1}),
+                 ("extreme a, b", {"a": 1e9, "b": 1e-9, "jitter": 0}))
+
+
+def _reference_get_colors(cspiral, k, offset=0.1):
+    """ The original ColorSpiral.get_colors() loop, for comparison
+
+        This calls colorsys.hsv_to_rgb(), log() and exp() and looks up the
+        spiral's attributes for each point.
+    """
+    v_rate = (cspiral._v_final - cspiral._v_init) / float(k)
+    for n in range(1, k+1):
+        t = (1./cspiral._b) * (log(n + (k * offset)) -
+                               log((1 + offset) * k * cspiral._a))
+        h = t
+        while h < 0:
+            h += 2 * pi
+        h = (h - (floor(h/(2 * pi)) * pi))
+        h = h / (2 * pi)
+        r = cspiral._a * exp(cspiral._b * t)
+        if cspiral._jitter:
+            jitter = random.random() * 2 * cspiral._jitter - cspiral._jitter
+        else:
+            jitter = 0
+        v = cspiral._v_init + (n * v_rate + jitter)
+        yield colorsys.hsv_to_rgb(h, r, max(0, min(v, 1)))
+
+
+def _time_colors(cspiral, k, repeats=3):
+    """ Return the best per-colour time (in seconds) over repeats runs of
+        cspiral.get_colors(k)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in cspiral.get_colors(k):
+            pass
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / k
+
+
+def bench_hue_wrapping(k=10000):
+    """ Per-colour latency of get_colors() across the (a, b) parameter range
+
+        Small b and large a give very negative spiral angles; hue wrapping
+        should take the same time for these as for the default parameters.
+    """
+    results = []
+    for a in (1e-3, 1, 4, 1e3, 1e9):
+        for b in (1e-9, 1e-3, 0.33, 10):
+            cspiral = ColorSpiral(a=a, b=b, jitter=0)
+            results.append((a, b, _time_colors(cspiral, k)))
+    return results
+
+
+def bench_pure_python(k=10 ** 6):
+    """ Time get_colors() against the original generator loop, for k
+        colours with and without jitter
+
+        Seeded jitter is calculated in NumPy blocks when NumPy is
+        installed, so that case is only pure Python without it.
+
+        Returns a list of (label, original seconds, current seconds) tuples.
+    """
+    results = []
+    for label, kwargs in (("no jitter", {"jitter": 0}),
+                          ("jitter", {"jitter": 0.05}),
+                          ("seeded jitter", {"jitter": 0.05, "seed": 1})):
+        cspiral = ColorSpiral(**kwargs)
+        timings = []
+        for colors in (_reference_get_colors(cspiral, k),
+                       cspiral.get_colors(k)):
+            start = time.perf_counter()
+            for _ in colors:
+                pass
+            timings.append(time.perf_counter() - start)
+        results.append((label, timings[0], timings[1]))
+    return results
+
+
+def bench_parallel(k=10 ** 7, max_workers=None):
+    """ Time get_colors_array() for k colours with 1 to max_workers worker
+        processes
+
+        Returns a list of (workers, seconds) tuples.
+    """
+    cspiral = ColorSpiral(jitter=0.05, seed=1)
+    results = []
+    for workers in range(1, (max_workers or os.cpu_count() or 1) + 1):
+        start = time.perf_counter()
+        cspiral.get_colors_array(k, workers=workers)
+        results.append((workers, time.perf_counter() - start))
+    return results
+
+
+def bench_render(k=10 ** 5, cell=2):
+    """ Time drawing a swatch grid of k colours with one ReportLab rect()
+        call per colour, against render_swatches() and save_image()
+
+        Returns a list of (label, seconds) tuples; the ReportLab timing is
+        omitted if ReportLab is not installed.
+    """
+    colors = ColorSpiral(jitter=0.05, seed=1).get_palette(k)
+    columns = max(1, int(k ** 0.5))
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            from reportlab.pdfgen.canvas import Canvas
+        except ImportError:
+            pass
+        else:
+            start = time.perf_counter()
+            rows = -(-k // columns)
+            canvas = Canvas(os.path.join(tmpdir, "swatches.pdf"),
+                            pagesize=(columns * cell, rows * cell))
+            for i, color in enumerate(colors):
+                canvas.setFillColor(color)
+                y, x = divmod(i, columns)
+                canvas.rect(x * cell, y * cell, cell, cell, fill=1, stroke=0)
+            canvas.save()
+            results.append(("ReportLab rects",
+                            time.perf_counter() - start))
+        for ext in (".png", ".pdf"):
+            start = time.perf_counter()
+            save_image(os.path.join(tmpdir, "swatches" + ext),
+                       render_swatches(colors, columns, cell))
+            results.append(("save_image(%s)" % ext,
+                            time.perf_counter() - start))
+    return results
+
+
+def bench_construct(n=10 ** 5):
+    """ Measure the cost of describing a spiral: constructing n ColorSpiral
+        objects, n SpiralSpec values, and n ColorSpiral objects from a
+        SpiralSpec
+
+        Returns a list of (label, seconds per object, bytes per object,
+        pickled bytes) tuples; the sizes are of objects with integer seeds.
+    """
+    spec = SpiralSpec(seed=1)
+    results = []
+    for label, make in (("ColorSpiral()", lambda: ColorSpiral(seed=1)),
+                        ("SpiralSpec()", lambda: SpiralSpec(seed=1)),
+                        ("from_spec()", lambda: ColorSpiral.from_spec(spec))):
+        start = time.perf_counter()
+        for _ in range(n):
+            make()
+        elapsed = (time.perf_counter() - start) / n
+        tracemalloc.start()
+        objects = [make() for _ in range(1000)]
+        size = tracemalloc.get_traced_memory()[0] / len(objects)
+        tracemalloc.stop()
+        results.append((label, elapsed, size,
+                        len(pickle.dumps(objects[0]))))
+    return results
+
+
+def bench_lut(ks=(10, 100, 1000, 10 ** 4, 10 ** 5),
+              tolerances=(1e-3, 1e-4, 1e-5, 1e-6), repeats=3):
+    """ Compare colours interpolated from a lookup table made by
+        ColorSpiral.build_lut() with those calculated directly, for a
+        dashboard-like workload of palettes of each size in ks
+
+        Returns a list of (tolerance, table entries, table bytes, build
+        seconds, largest error, get_colors() seconds, get_colors_array()
+        seconds) tuples, the first with a tolerance of None for direct
+        calculation.
+    """
+    exact = ColorSpiral(jitter=0.05, seed=1)
+    reference = [exact.get_colors_array(k) for k in ks]
+
+    def run(cspiral):
+        timings = []
+        for method in (lambda k: _consume(cspiral.get_colors(k)),
+                       cspiral.get_colors_array):
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                for k in ks:
+                    method(k)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        return timings
+
+    results = [(None, 0, 0, 0.0, 0.0) + tuple(run(exact))]
+    for tolerance in tolerances:
+        cspiral = ColorSpiral(jitter=0.05, seed=1)
+        start = time.perf_counter()
+        entries = cspiral.build_lut(tolerance)
+        built = time.perf_counter() - start
+        error = max(float(abs(cspiral.get_colors_array(k) - colors).max())
+                    for k, colors in zip(ks, reference))
+        timings = tuple(run(cspiral))
+        results.append((tolerance, entries, cspiral._lut.nbytes, built,
+                        error) + timings)
+    return results
+
+
+def bench_metrics(n=10 ** 5):
+    """ Time n calls of get_colors(10) on a cached palette with metrics
+        disabled and enabled
+
+        Returns a list of (label, seconds per call) tuples.
+    """
+    get_colors(10, jitter=0)
+    results = []
+    for label, enabled in (("disabled", False), ("enabled", True)):
+        with collect_metrics() if enabled else contextlib.nullcontext():
+            start = time.perf_counter()
+            for _ in range(n):
+                get_colors(10, jitter=0)
+            results.append((label, (time.perf_counter() - start) / n))
+    return results
+
+
+def load_test(address, requests=2000, concurrency=16,
+              ks=(10, 100, 1000), seeds=16, fmt="packed"):
+    """ Send requests for palettes to a palette server at address from
+        concurrency connections, each waiting for the answer to one request
+        before sending the next
+
+        The requests are for random choices of k from ks and seeds from
+        range(seeds), so that some palettes are requested repeatedly.
+        Returns a dictionary of the number of requests, errors, elapsed
+        seconds, requests per second, and the median and 99th percentile
+        latencies in seconds.
+    """
+    rng = random.Random(1)
+    lines = [json.dumps({"k": rng.choice(ks), "fmt": fmt,
+                         "params": {"seed": rng.randrange(seeds)}}).encode()
+             + b"\n" for _ in range(requests)]
+    latencies = []
+    errors = []
+
+    async def client():
+        reader, writer = await open_palette_connection(address)
+        while lines:
+            line = lines.pop()
+            start = time.perf_counter()
+            writer.write(line)
+            answer = await reader.readline()
+            latencies.append(time.perf_counter() - start)
+            if not answer.startswith(b'{"colors"'):
+                errors.append(answer)
+        writer.close()
+        await writer.wait_closed()
+
+    async def run():
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"requests": len(latencies), "errors": len(errors),
+            "seconds": elapsed, "throughput": len(latencies) / elapsed,
+            "p50": latencies[len(latencies) // 2],
+            "p99": latencies[min(len(latencies) - 1,
+                                 len(latencies) * 99 // 100)]}
+
+
+def bench_server(address=None, **kwargs):
+    """ Run load_test() against the palette server at address, or if
+        address is None, against one started in a new process on a Unix
+        socket (with its startup time excluded)
+
+        Other arguments are passed to load_test().
+    """
+    if address is not None:
+        return load_test(address, **kwargs)
+    tmpdir = tempfile.mkdtemp()
+    address = os.path.join(tmpdir, "palette.sock")
+    server = subprocess.Popen(
+        [sys.executable, "-c",
+         "import ColorSpiral; ColorSpiral.serve_palettes(%r)" % address],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        deadline = time.time() + 30
+        while not os.path.exists(address):
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError("palette server did not start")
+            time.sleep(0.01)
+        return load_test(address, **kwargs)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmpdir)
+
+
+def _consume(iterable):
+    """ Exhaust an iterable, discarding its items """
+    for _ in iterable:
+        pass
+
+
+def _suite_cases(max_k):
+    """ Generator of (name, k, params, func) tuples for the benchmark suite
+
+        func is a function of no arguments that runs the benchmark once.
+    """
+    for k in SUITE_KS:
+        if k > max_k:
+            continue
+        for label, kwargs in SUITE_SPIRALS:
+            cspiral = ColorSpiral(**kwargs)
+            yield ("get_colors", k, label,
+                   lambda cspiral=cspiral, k=k:
+                   _consume(cspiral.get_colors(k)))
+            if np is not None:
+                yield ("get_colors_array", k, label,
+                       lambda cspiral=cspiral, k=k:
+                       cspiral.get_colors_array(k))
+            yield ("get_palette", k, label,
+                   lambda cspiral=cspiral, k=k: cspiral.get_palette(k))
+        if k > MAX_DICT_K:
+            continue
+        for label, keys in (("str keys", ["key%d" % i for i in range(k)]),
+                            ("int keys", list(range(k)))):
+            yield ("get_color_dict", k, label,
+                   lambda keys=keys: (palette_cache.clear(),
+                                      get_color_dict(keys, jitter=0)))
+
+
+def measure(func, k, repeats=3):
+    """ Return a dictionary of measurements from running func, which
+        generates k colours
+
+        Throughput and latency are taken from the fastest of repeats runs;
+        peak memory is measured by tracemalloc in a separate run, as
+        tracing slows the benchmark.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best,
+            "colours_per_second": k / best if best else float("inf"),
+            "us_per_colour": best * 1e6 / k,
+            "peak_bytes": peak}
+
+
+def bench_suite(max_k=10 ** 7, repeats=3, verbose=False):
+    """ Run the benchmark suite, for values of k up to max_k
+
+        Returns a list of dictionaries, one per benchmark, holding its name,
+        k and parameter label with the measurements from measure().
+    """
+    results = []
+    for name, k, label, func in _suite_cases(max_k):
+        result = {"name": name, "k": k, "params": label}
+        result.update(measure(func, k, repeats))
+        results.append(result)
+        if verbose:
+            print(_format_result(result))
+            sys.stdout.flush()
+    return results
+
+
+def _format_result(result):
+    """ Return a line of the results table for a benchmark result """
+    return "%-17s %-14s k=%-9d %12.0f colours/s %9.3f us/colour " \
+        "%12d bytes peak" % (result["name"], result["params"], result["k"],
+                             result["colours_per_second"],
+                             result["us_per_colour"], result["peak_bytes"])
+
+
+def save_results(results, filename):
+    """ Write benchmark results to filename as JSON, with a description of
+        the platform they were run on
+    """
+    environment = {"python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "numpy": np.__version__ if np is not None else None,
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(filename, "w") as handle:
+        json.dump({"environment": environment, "results": results}, handle,
+                  indent=1)
+
+
+def load_results(filename):
+    """ Return the benchmark results saved in filename """
+    with open(filename) as handle:
+        return json.load(handle)["results"]
+
+
+def compare_results(baseline, results, tolerance=0.1):
+    """ Return a list of (baseline, result) pairs for benchmarks in results
+        that are more than tolerance (as a fraction) slower than the same
+        benchmark in baseline
+    """
+    def key(result):
+        return (result["name"], result["k"], result["params"])
+    previous = dict((key(result), result) for result in baseline)
+    slower = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is not None and \
+                result["seconds"] > old["seconds"] * (1 + tolerance):
+            slower.append((old, result))
+    return slower
+
+
+def test_suite():
+    """ Benchmark suite runs, and reports every measurement."""
+    results = bench_suite(max_k=1000, repeats=1)
+    names = set(result["name"] for result in results)
+    assert set(["get_colors", "get_palette", "get_color_dict"]) <= names
+    for result in results:
+        assert result["seconds"] >= 0
+        assert result["peak_bytes"] >= 0
+        assert result["colours_per_second"] > 0
+
+
+def test_save_and_compare(tmpdir):
+    """ Saved results can be reloaded and compared."""
+    results = bench_suite(max_k=10, repeats=1)
+    filename = str(tmpdir.join("results.json"))
+    save_results(results, filename)
+    baseline = load_results(filename)
+    assert baseline == results
+    assert compare_results(baseline, results) == []
+    slower = [dict(result, seconds=result["seconds"] * 2 + 1)
+              for result in results]
+    assert len(compare_results(baseline, slower)) == len(results)
+
+
+def test_load_test():
+    """ The load test runs against a new palette server """
+    result = bench_server(requests=50, concurrency=4)
+    assert result["requests"] == 50 and result["errors"] == 0
+    assert 0 < result["p50"] <= result["p99"]
+
+
+def _print_load_test(address):
+    """ Print the results of a load test of a palette server """
+    result = bench_server(address)
+    print("Palette server: %d requests (%d errors) in %.3f s, %.0f per second"
+          % (result["requests"], result["errors"], result["seconds"],
+             result["throughput"]))
+    print("  latency p50 %8.3f ms  p99 %8.3f ms" %
+          (result["p50"] * 1e3, result["p99"] * 1e3))
+
+
+def _print_extra():
+    """ Print results of the hue wrapping, pure Python, parallel scaling,
+        rendering, construction, lookup table and metrics benchmarks
+    """
+    print("Hue wrapping: per-colour latency of get_colors()")
+    for a, b, latency in bench_hue_wrapping():
+        print("  a=%-8g b=%-8g %8.3f us/colour" % (a, b, latency * 1e6))
+    print("Pure Python: get_colors(10**6) against the original loop")
+    for label, original, current in bench_pure_python():
+        print("  %-14s %8.3f s -> %8.3f s  (speedup %.2fx)" %
+              (label, original, current, original / current))
+    print("Parallel scaling: get_colors_array(10**7)")
+    results = bench_parallel()
+    for workers, elapsed in results:
+        print("  %2d workers %8.3f s  (speedup %.2fx)" %
+              (workers, elapsed, results[0][1] / elapsed))
+    print("Rendering: swatch grid of 10**5 colours")
+    for label, elapsed in bench_render():
+        print("  %-16s %8.3f s" % (label, elapsed))
+    print("Construction: time, memory and pickled size per object")
+    for label, elapsed, size, pickled in bench_construct():
+        print("  %-14s %8.3f us %6d bytes %6d bytes pickled" %
+              (label, elapsed * 1e6, size, pickled))
+    print("Lookup table: error and speed against direct calculation, "
+          "k = 10 to 10**5")
+    print("  %-9s %8s %9s %8s %9s %9s %9s" %
+          ("tolerance", "entries", "MB", "build s", "max error",
+           "colors s", "array s"))
+    for tolerance, entries, nbytes, built, error, python, vector in \
+            bench_lut():
+        print("  %-9s %8d %9.2f %8.3f %9.2g %9.4f %9.4f" %
+              ("direct" if tolerance is None else "%g" % tolerance, entries,
+               nbytes / 1e6, built, error, python, vector))
+    print("Metrics: cached get_colors(10) per call")
+    for label, elapsed in bench_metrics():
+        print("  %-9s %8.3f us" % (label, elapsed * 1e6))
+
+
+def main(argv=None):
+    """ Run the benchmark suite from the command line """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--max-k", type=int, default=10 ** 7,
+                        help="largest number of colours to generate")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="number of timed runs of each benchmark")
+    parser.add_argument("--output", help="file to write JSON results to")
+    parser.add_argument("--compare",
+                        help="JSON results to report slower benchmarks "
+                        "against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fractional slowdown reported by --compare")
+    parser.add_argument("--extra", action="store_true",
+                        help="also run the hue wrapping, pure Python, "
+                        "parallel scaling, rendering, construction, lookup "
+                        "table and metrics benchmarks")
+    parser.add_argument("--load-test", nargs="?", const="", metavar="ADDRESS",
+                        help="load test the palette server at ADDRESS "
+                        "(host:port or a Unix socket path), or if none is "
+                        "given, one started for the test")
+    args = parser.parse_args(argv)
+    results = bench_suite(args.max_k, args.repeats, verbose=True)
+    if args.output:
+        save_results(results, args.output)
+    status = 0
+    if args.compare:
+        slower = compare_results(load_results(args.compare), results,
+                                 args.tolerance)
+        for old, new in slower:
+            print("SLOWER: %s %s k=%d: %.4f s -> %.4f s" %
+                  (new["name"], new["params"], new["k"], old["seconds"],
+                   new["seconds"]))
+        status = 1 if slower else 0
+    if args.extra:
+        _print_extra()
+    if args.load_test is not None:
+        _print_load_test(args.load_test or None)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -43,11 +43,23 @@
 """
 
 # Builtins
+import asyncio
+import array
 import cmath
 import colorsys
+import json
+from itertools import islice
 from math import pi
 import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import time
 import unittest
+import weakref
+import zlib
 
 # Do we have ReportLab?  Raise error if not present.
 from Bio import MissingPythonDependencyError
@@ -59,7 +71,14 @@ except ImportError:
         "Install reportlab if you want to use Bio.Graphics.")
 
 # Biopython Bio.Graphics.ColorSpiral
-from ColorSpiral import ColorSpiral, get_colors, get_color_dict
+from ColorSpiral import ColorSpiral, get_colors, get_color_dict, \
+    get_colors_array, palette_cache, PaletteCache, iter_color_items, \
+    get_palette, Palette, get_colors_for_codes, get_hashed_color, \
+    save_palette, load_palette, open_palette, PaletteIndex, \
+    evaluate_palette, tune_spiral, get_colors_sweep, render_swatches, \
+    render_spiral, save_image, SpiralSpec, Metrics, collect_metrics, \
+    enable_metrics, disable_metrics, PaletteServer, open_palette_connection, \
+    main, np, _export_bytes
 
 
 class SpiralTest(unittest.TestCase):
@@ -141,11 +160,962 @@ class DictTest(unittest.TestCase):
         classes = ['A', 'B', 'C', 'D']
         colors = get_color_dict(classes, jitter=0)
         cstr = ["%s: (%.2f, %.2f, %.2f)" % (c, r, g, b)
-                for c, (r, g, b) in colors.items()]
-        expected = ['A: (0.52, 0.76, 0.69)', 'C: (0.59, 0.13, 0.47)',
-                    'B: (0.40, 0.31, 0.68)', 'D: (0.50, 0.00, 0.00)']
+                for c, (r, g, b) in sorted(colors.items())]
+        expected = ['A: (0.52, 0.76, 0.69)', 'B: (0.40, 0.31, 0.68)',
+                    'C: (0.59, 0.13, 0.47)', 'D: (0.50, 0.00, 0.00)']
         self.assertEqual(cstr, expected)
 
+    def test_empty(self):
+        """ No colours for no classes
+        """
+        self.assertEqual(list(get_colors(0)), [])
+        self.assertEqual(list(ColorSpiral().get_colors(0)), [])
+        self.assertEqual(get_color_dict([]), {})
+        self.assertEqual(get_colors_array(0).shape, (0, 3))
+        self.assertEqual(len(get_palette(0)), 0)
+
+
+class StreamTest(unittest.TestCase):
+    """ Colour streams of classes without building a dictionary
+    """
+    def test_iter_color_items(self):
+        """ iter_color_items() agrees with get_color_dict()."""
+        classes = ["class%d" % i for i in range(100)]
+        expected = get_color_dict(classes, jitter=0)
+        self.assertEqual(dict(iter_color_items(classes, jitter=0)), expected)
+        # Count-hinted one-shot iterator, and two-pass unsized iterable
+        self.assertEqual(dict(iter_color_items(iter(classes), k=100,
+                                               jitter=0)), expected)
+        self.assertEqual(get_color_dict(StreamTest.Reiterable(classes),
+                                        jitter=0), expected)
+
+    def test_one_shot_iterators(self):
+        """ One-shot iterators need k, or stable colours."""
+        stream = (str(i) for i in range(50))
+        self.assertRaises(TypeError, iter_color_items, stream)
+        items = iter_color_items((str(i) for i in range(50)), stable=True,
+                                 jitter=0)
+        self.assertEqual(dict(items),
+                         get_color_dict([str(i) for i in range(50)],
+                                        stable=True, jitter=0))
+        items = iter_color_items(range(5), k=4, jitter=0)
+        self.assertRaises(ValueError, list, items)
+        self.assertRaises(TypeError, get_color_dict, iter("ABC"))
+        self.assertEqual(get_color_dict(iter("ABC"), k=3, jitter=0),
+                         get_color_dict("ABC", jitter=0))
+        self.assertRaises(ValueError, get_color_dict, "ABC", k=2)
+
+    class Reiterable(object):
+        """ Iterable without a length, that may be iterated over again"""
+        def __init__(self, items):
+            self.items = items
+
+        def __iter__(self):
+            return iter(self.items)
+
+
+class ArrayTest(unittest.TestCase):
+    """ Generate colours as a NumPy array
+    """
+    def test_array_matches_generator(self):
+        """ get_colors_array() agrees with get_colors(), no jitter."""
+        for a, b in ((4, 0.33), (1, 0.33), (0.2, 2), (10, 0.05)):
+            cs = ColorSpiral(a=a, b=b, jitter=0)
+            colours = cs.get_colors_array(1000)
+            self.assertEqual(colours.shape, (1000, 3))
+            for (r1, g1, b1), (r2, g2, b2) in zip(cs.get_colors(1000),
+                                                  colours):
+                self.assertAlmostEqual(r1, r2, places=12)
+                self.assertAlmostEqual(g1, g2, places=12)
+                self.assertAlmostEqual(b1, b2, places=12)
+
+    def test_array_parallel(self):
+        """ get_colors_array() is the same with several workers."""
+        cs = ColorSpiral(jitter=0.2, seed=9)
+        serial = cs.get_colors_array(10001)
+        parallel = cs.get_colors_array(10001, workers=3)
+        self.assertTrue((serial == parallel).all())
+
+    def test_array_parallel_stream(self):
+        """ Several workers take jitter from any object with random()."""
+        class Stream(object):
+            def random(self):
+                return 0.5
+
+        colours = ColorSpiral(jitter=0.2, seed=Stream()).get_colors_array(
+            1001, workers=2)
+        self.assertEqual(colours.shape, (1001, 3))
+        self.assertTrue(((colours >= 0) & (colours <= 1)).all())
+
+    def test_array_chunks(self):
+        """ iter_color_chunks() yields get_colors_array() in blocks."""
+        cs = ColorSpiral(jitter=0.2, seed=9)
+        colours = cs.get_colors_array(1000)
+        chunks = list(cs.iter_color_chunks(1000, 256))
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [256, 256, 256, 232])
+        for i, chunk in enumerate(chunks):
+            self.assertTrue((chunk == colours[256 * i:256 * (i + 1)]).all())
+        # Any (256, 3) array will do as the output buffer
+        out = get_colors_array(256, jitter=0)
+        for i, chunk in enumerate(cs.iter_color_chunks(1000, 256, out=out)):
+            self.assertTrue(chunk.base is out or chunk is out)
+            self.assertTrue((chunk == colours[256 * i:256 * (i + 1)]).all())
+        self.assertRaises(ValueError, cs.iter_color_chunks, 1000, 100,
+                          out=out)
+
+    def test_array_jitter(self):
+        """ get_colors_array() with jitter keeps values in [0, 1]."""
+        colours = get_colors_array(625, jitter=0.5)
+        self.assertEqual(colours.shape, (625, 3))
+        self.assertTrue((colours >= 0).all() and (colours <= 1).all())
+
+    def test_value_rounding(self):
+        """ Unjittered brightness rounded past 1 is clamped, as in arrays."""
+        cs = ColorSpiral(v_init=0.1, v_final=1, jitter=0)
+        self.assertEqual(list(cs.get_colors(1831))[-1], (1.0, 0.0, 0.0))
+        self.assertEqual(tuple(cs.get_colors_array(1831)[-1]),
+                         (1.0, 0.0, 0.0))
+
+
+class DegenerateTest(unittest.TestCase):
+    """ Spiral parameters at the limits permitted by the setters
+    """
+    def test_zero_parameters(self):
+        """ a == 0 or b == 0 raises ValueError."""
+        for a, b in ((0, 0.33), (1, 0), (0, 0)):
+            cs = ColorSpiral(a=a, b=b, jitter=0)
+            self.assertRaises(ValueError, list, cs.get_colors(8))
+            self.assertRaises(ValueError, cs.get_colors_array, 8)
+
+    def test_negative_k(self):
+        """ Negative k raises ValueError."""
+        cs = ColorSpiral(jitter=0)
+        self.assertRaises(ValueError, list, cs.get_colors(-3))
+        self.assertRaises(ValueError, cs.get_colors_array, -3)
+        self.assertRaises(ValueError, get_colors, -3)
+
+    def test_extreme_parameters(self):
+        """ Very small b and very large a give colours in [0, 1]."""
+        for a, b in ((1, 1e-12), (1e12, 0.33), (1e9, 1e-9)):
+            cs = ColorSpiral(a=a, b=b, jitter=0)
+            colours = list(cs.get_colors(100))
+            for colour in colours:
+                for channel in colour:
+                    self.assertTrue(-1e-9 <= channel <= 1 + 1e-9)
+            array = cs.get_colors_array(100)
+            for (r1, g1, b1), (r2, g2, b2) in zip(colours, array):
+                self.assertAlmostEqual(r1, r2, places=6)
+                self.assertAlmostEqual(g1, g2, places=6)
+                self.assertAlmostEqual(b1, b2, places=6)
+
+
+class SeedTest(unittest.TestCase):
+    """ Reproducible jitter from a per-object seed
+    """
+    def test_seeded_reproducible(self):
+        """ Same integer seed gives the same jittered colours."""
+        colours = list(get_colors(100, jitter=0.2, seed=42))
+        random.seed(1)
+        self.assertEqual(colours, list(get_colors(100, jitter=0.2, seed=42)))
+        self.assertNotEqual(colours,
+                            list(get_colors(100, jitter=0.2, seed=43)))
+
+    def test_seeded_array(self):
+        """ get_colors_array() agrees with get_colors() when seeded."""
+        cs = ColorSpiral(jitter=0.2, seed=7)
+        for (r1, g1, b1), (r2, g2, b2) in zip(cs.get_colors(500),
+                                              cs.get_colors_array(500)):
+            self.assertAlmostEqual(r1, r2, places=12)
+            self.assertAlmostEqual(g1, g2, places=12)
+            self.assertAlmostEqual(b1, b2, places=12)
+
+    def test_rng_object(self):
+        """ Jitter may be drawn from a random.Random object."""
+        colours = list(get_colors(50, seed=random.Random(3)))
+        self.assertEqual(colours, list(get_colors(50, seed=random.Random(3))))
+
+    def test_rng_array(self):
+        """ Array jitter takes one draw from the stream for each block."""
+        class Stream(object):
+            draws = 0
+
+            def random(self):
+                self.draws += 1
+                return 0.25
+
+        stream = Stream()
+        colours = ColorSpiral(jitter=0.2, seed=stream).get_colors_array(1000)
+        self.assertEqual(stream.draws, 1)
+        self.assertEqual(colours.shape, (1000, 3))
+
+    def test_bad_seed(self):
+        """ Seeds that are not integers or streams raise TypeError."""
+        for seed in (3.0, "3"):
+            self.assertRaises(TypeError, ColorSpiral, seed=seed)
+            self.assertRaises(TypeError, SpiralSpec, seed=seed)
+
+
+class RandomAccessTest(unittest.TestCase):
+    """ Look up colours by index without generating the whole spiral
+    """
+    def test_color_at(self):
+        """ color_at() agrees with get_colors(), with seeded jitter."""
+        cs = ColorSpiral(jitter=0.2, seed=11)
+        colours = list(cs.get_colors(1000))
+        for n in (0, 1, 499, 998, 999, -1, -1000):
+            self.assertEqual(cs.color_at(n, 1000), colours[n])
+        self.assertRaises(IndexError, cs.color_at, 1000, 1000)
+        self.assertRaises(IndexError, cs.color_at, -1001, 1000)
+        # Across the blocks in which seeded jitter is calculated
+        colours = list(cs.get_colors(10000))
+        stable = list(islice(cs.get_stable_colors(None), 10000))
+        for n in (4095, 4096, 8192, 9999):
+            self.assertEqual(cs.color_at(n, 10000), colours[n])
+            self.assertEqual(cs.color_at_stable(n), stable[n])
+
+    def test_colors_range(self):
+        """ colors_range() agrees with slices of get_colors()."""
+        cs = ColorSpiral(jitter=0.2, seed=11)
+        colours = list(cs.get_colors(1000))
+        for start, stop in ((0, 10), (250, 750), (990, 2000), (-5, None),
+                            (10, 5)):
+            self.assertEqual(cs.colors_range(start, stop, 1000),
+                             colours[start:stop])
+
+
+class HashTest(unittest.TestCase):
+    """ Colours chosen by a stable hash of each key
+    """
+    def test_hashed_color(self):
+        """ Hashed colours are fixed, and come from the stable sequence."""
+        cs = ColorSpiral(jitter=0.1, seed=1)
+        stable = list(cs.get_stable_colors(64))
+        for key in ("chr1", b"chr1", 42, "gene:\u00e9"):
+            colour = cs.color_for_key(key, buckets=64)
+            self.assertTrue(colour in stable)
+            self.assertEqual(colour, get_hashed_color(key, buckets=64,
+                                                      jitter=0.1, seed=1))
+        self.assertEqual(cs.color_for_key("chr1"), cs.color_for_key(b"chr1"))
+        self.assertEqual(cs.color_at_stable(10), stable[10])
+
+    def test_consistent_buckets(self):
+        """ Adding buckets moves few keys to new colours."""
+        cs = ColorSpiral(jitter=0)
+        keys = ["key%d" % i for i in range(1000)]
+        before = [cs.color_for_key(key, buckets=100) for key in keys]
+        after = [cs.color_for_key(key, buckets=101) for key in keys]
+        moved = sum(1 for old, new in zip(before, after) if old != new)
+        self.assertTrue(0 < moved < 50)
+
+
+class CodesTest(unittest.TestCase):
+    """ Colour arrays of integer category codes
+    """
+    def test_codes(self):
+        """ colors_for_codes() gathers from get_colors_array()."""
+        cs = ColorSpiral(jitter=0)
+        palette = cs.get_colors_array(10)
+        codes = [3, 0, 9, 3, -1]
+        colours = cs.colors_for_codes(codes, k=10, na_color=(1, 1, 1))
+        self.assertEqual(colours.shape, (5, 3))
+        self.assertEqual(colours[:4].tolist(), palette[codes[:4]].tolist())
+        self.assertEqual(colours[4].tolist(), [1, 1, 1])
+        self.assertEqual(get_colors_for_codes([2, 4], jitter=0).tolist(),
+                         cs.get_colors_array(5)[[2, 4]].tolist())
+        self.assertRaises(IndexError, cs.colors_for_codes, [10], 10)
+
+    def test_packed(self):
+        """ Packed colours agree with Palette.to_hex()."""
+        cs = ColorSpiral(jitter=0)
+        hexes = cs.get_palette(8).to_hex()
+        packed = cs.colors_for_codes(range(8), packed=True)
+        self.assertEqual(["#%06x" % value for value in packed], hexes)
+
+    def test_categorical(self):
+        """ Codes and categories are taken from Categorical-like objects."""
+        class Categorical(object):
+            """ Minimal object with the pandas Categorical interface"""
+            codes = [0, 1, 1, -1]
+            categories = ["x", "y", "z"]
+        colours = get_colors_for_codes(Categorical(), jitter=0)
+        palette = get_colors_array(3, jitter=0)
+        self.assertEqual(colours[:3].tolist(), palette[[0, 1, 1]].tolist())
+        self.assertEqual(colours[3].tolist(), [0, 0, 0])
+
+    def test_empty(self):
+        """ No codes give no colours; non-integer codes are rejected."""
+        cs = ColorSpiral(jitter=0)
+        self.assertEqual(cs.colors_for_codes([]).shape, (0, 3))
+        self.assertEqual(cs.colors_for_codes([], packed=True).shape, (0,))
+        self.assertRaises(TypeError, cs.colors_for_codes, [0.5, 1.0])
+
+
+class FormatTest(unittest.TestCase):
+    """ Return colours as 8-bit integers, packed integers or hex strings
+    """
+    def test_formats(self):
+        """ Each output format agrees with rounding the float colours."""
+        cs = ColorSpiral(jitter=0.2, seed=2)
+        floats = list(cs.get_colors(20))
+        rgb8 = [tuple(int(max(0, min(x, 1)) * 255 + 0.5) for x in colour)
+                for colour in floats]
+        packed = [(r << 16) | (g << 8) | b for r, g, b in rgb8]
+        hexes = ["#%02x%02x%02x" % colour for colour in rgb8]
+        for fmt, expected in (("rgb8", rgb8), ("packed", packed),
+                              ("hex", hexes)):
+            self.assertEqual(list(cs.get_colors(20, fmt=fmt)), expected)
+            self.assertEqual(list(get_colors(20, fmt=fmt, jitter=0.2,
+                                             seed=2)), expected)
+            cdict = get_color_dict(range(20), fmt=fmt, jitter=0.2, seed=2)
+            self.assertEqual([cdict[i] for i in range(20)], expected)
+            items = iter_color_items(iter(range(20)), 20, fmt=fmt,
+                                     jitter=0.2, seed=2)
+            self.assertEqual([colour for _, colour in items], expected)
+        self.assertEqual(get_hashed_color("A", fmt="hex", jitter=0),
+                         "#%02x%02x%02x" % tuple(
+                             int(x * 255 + 0.5) for x in
+                             get_hashed_color("A", jitter=0)))
+
+    def test_invalid(self):
+        """ Unknown output formats are rejected."""
+        self.assertRaises(ValueError, ColorSpiral().get_colors, 5, fmt="rgb")
+        self.assertRaises(ValueError, get_color_dict, "AB", fmt="RGB")
+
+
+class PaletteTest(unittest.TestCase):
+    """ Compact, buffer-backed palettes
+    """
+    def test_palette_sequence(self):
+        """ Palette behaves as a sequence of RGB tuples."""
+        colours = list(ColorSpiral(jitter=0).get_colors(100))
+        palette = Palette.from_colors(colours)
+        self.assertEqual(len(palette), 100)
+        self.assertEqual(list(palette), colours)
+        self.assertEqual(palette[-1], colours[-1])
+        self.assertEqual(list(palette[10:20]), colours[10:20])
+        self.assertEqual(list(palette[::7]), colours[::7])
+        self.assertEqual(palette.nbytes, 100 * 3 * 8)
+        self.assertRaises(IndexError, palette.__getitem__, 100)
+
+    def test_zero_copy(self):
+        """ Slices and array views share the palette's buffer."""
+        data = get_colors_array(50, jitter=0)
+        palette = Palette(data)
+        view = palette[10:20]
+        data[10] = (1, 1, 1)
+        self.assertEqual(view[0], (1.0, 1.0, 1.0))
+        self.assertEqual(palette.buffer.shape, (50, 3))
+        self.assertEqual(palette.to_array()[10].tolist(), [1, 1, 1])
+
+    def test_conversions(self):
+        """ Palettes convert to 8-bit values, hex strings and ReportLab."""
+        palette = get_palette(8, a=4, jitter=0)
+        self.assertAlmostEqual(palette[0][0], 0.64, places=2)
+        self.assertEqual(palette.to_rgb8()[7], (1, 128, 0))
+        self.assertEqual(get_palette(8, a=4, jitter=0, typecode='B'),
+                         palette.to_rgb8())
+        self.assertEqual(palette.to_hex()[7], "#018000")
+        self.assertEqual(palette.to_reportlab()[0].rgb(), palette[0])
+        self.assertEqual(get_palette(8, a=4, jitter=0, typecode='f').nbytes,
+                         8 * 3 * 4)
+
+
+class IndexTest(unittest.TestCase):
+    """ Map colours back to the categories they were assigned to
+    """
+    def setUp(self):
+        """ Index a dictionary of colours"""
+        self.cdict = get_color_dict(["class%d" % i for i in range(200)],
+                                    jitter=0)
+        self.index = PaletteIndex.from_dict(self.cdict)
+
+    def test_lookup(self):
+        """ Exact and tolerant lookups of single colours."""
+        for key, colour in self.cdict.items():
+            self.assertEqual(self.index.lookup(colour), key)
+        key, (r, g, b) = "class50", self.cdict["class50"]
+        rgb8 = self.index.rgb8[50]
+        self.assertEqual(self.index.lookup(rgb8), key)
+        shifted = (rgb8[0], rgb8[1] + 1, rgb8[2])
+        if self.index.lookup(shifted) is None:
+            self.assertEqual(self.index.lookup(shifted, tolerance=2), key)
+            self.assertEqual(self.index.lookup(shifted, tolerance=0.5), None)
+        self.assertEqual(self.index.nearest_index(shifted)[0], 50)
+        # Equally near colours are resolved by the lowest index
+        between = (rgb8[0] + 1, rgb8[1], rgb8[2] - 1)
+        self.assertEqual(self.index.rgb8[49], (133, 194, 175))
+        self.assertEqual(self.index.nearest_index(between), (49, 2 ** 0.5))
+
+    def test_nearest(self):
+        """ nearest_index() agrees with a linear search."""
+        rng = random.Random(0)
+        for _ in range(100):
+            colour = tuple(rng.randrange(256) for _ in range(3))
+            index, distance = self.index.nearest_index(colour)
+            best = min(sum((p - c) ** 2 for p, c in zip(rgb8, colour))
+                       for rgb8 in self.index.rgb8)
+            self.assertAlmostEqual(distance, best ** 0.5)
+
+    def test_lookup_array(self):
+        """ Lookups of whole images agree with single lookups."""
+        image = get_colors_array(200, jitter=0).reshape(10, 20, 3)
+        indices = self.index.lookup_array(image)
+        self.assertEqual(indices.shape, (10, 20))
+        self.assertEqual(indices.ravel().tolist(),
+                         [self.index.lookup_index(colour)
+                          for colour in image.reshape(-1, 3)])
+        image = (image * 0.98).reshape(-1, 3)
+        self.assertEqual(self.index.lookup_array(image, 5).tolist(),
+                         [-1 if index is None else index for index in
+                          (self.index.lookup_index(colour, 5)
+                           for colour in image)])
+
+
+    def test_lookup_image(self):
+        """ Tolerant lookups of a noisy image are fast, and exact."""
+        colours = get_colors_array(1000, jitter=0)
+        index = PaletteIndex(colours)
+        fine = PaletteIndex(colours, cell=2)
+        rng = np.random.default_rng(0)
+        image = render_swatches(colours, columns=32, cell=7)[:200, :200]
+        image = (image + rng.integers(-6, 7, image.shape)).clip(0, 255)
+        for tolerance in (1.5, 5, 16, 500):
+            start = time.perf_counter()
+            indices = index.lookup_array(image, tolerance)
+            self.assertTrue(time.perf_counter() - start < 5)
+            self.assertEqual(fine.lookup_array(image, tolerance).tolist(),
+                             indices.tolist())
+            for i, j in rng.integers(0, 200, (50, 2)).tolist():
+                colour = tuple(image[i, j].tolist())
+                nearest = index.lookup_index(colour, tolerance)
+                self.assertEqual(indices[i, j],
+                                 -1 if nearest is None else nearest)
+                distance = min(sum((p - c) ** 2 for p, c in zip(rgb8, colour))
+                               for rgb8 in index.rgb8) ** 0.5
+                self.assertEqual(nearest is None, distance > tolerance)
+
+
+class LookupTableTest(unittest.TestCase):
+    """ Interpolate colours from a lookup table along the spiral
+    """
+    def test_tolerance(self):
+        """ Colours from the lookup table are within tolerance."""
+        for a, b, tolerance in ((1, 0.33, 1e-3), (4, 0.33, 1e-4),
+                                (10, 0.05, 1e-4), (0.2, 2, 1e-5)):
+            exact = ColorSpiral(a=a, b=b, jitter=0.1, seed=3)
+            cs = ColorSpiral(a=a, b=b, jitter=0.1, seed=3)
+            cs.build_lut(tolerance)
+            for k in (7, 1000, 20000):
+                error = abs(cs.get_colors_array(k) -
+                            exact.get_colors_array(k)).max()
+                self.assertTrue(error <= tolerance, (a, b, k, error))
+                error = max(abs(p - q) for c1, c2 in
+                            zip(cs.get_colors(k), exact.get_colors(k))
+                            for p, q in zip(c1, c2))
+                self.assertTrue(error <= tolerance, (a, b, k, error))
+            for c1, c2 in zip(cs.get_stable_colors(50),
+                              exact.get_stable_colors(50)):
+                for p, q in zip(c1, c2):
+                    self.assertAlmostEqual(p, q, delta=tolerance)
+
+    def test_invalidate(self):
+        """ The lookup table is only used for the spiral it was built for."""
+        cs = ColorSpiral(jitter=0)
+        cs.build_lut(1e-3)
+        key = cs._cache_key(10, 0.1)
+        self.assertNotEqual(key, ColorSpiral(jitter=0)._cache_key(10, 0.1))
+        # Colours for offsets not covered by the table are exact
+        self.assertEqual(list(cs.get_colors(10, 0.05)),
+                         list(ColorSpiral(jitter=0).get_colors(10, 0.05)))
+        cs.a = 2
+        self.assertEqual(list(cs.get_colors(10)),
+                         list(ColorSpiral(a=2, jitter=0).get_colors(10)))
+        cs.build_lut(1e-3)
+        cs.clear_lut()
+        self.assertEqual(cs._cache_key(10, 0.1),
+                         ColorSpiral(a=2, jitter=0)._cache_key(10, 0.1))
+        self.assertRaises(ValueError, cs.build_lut, 1e-9, max_size=4096)
+
+
+class QualityTest(unittest.TestCase):
+    """ Measure palette separation, and tune spiral parameters
+    """
+    def test_evaluate(self):
+        """ evaluate_palette() agrees with all-pairs colour differences."""
+        palette = get_palette(300, jitter=0.1, seed=4)
+        measures = evaluate_palette(palette)
+        lab = [colour_to_lab(colour) for colour in palette]
+        nearest = [min(sum((p - q) ** 2 for p, q in zip(lab1, lab2)) ** 0.5
+                       for j, lab2 in enumerate(lab) if i != j)
+                   for i, lab1 in enumerate(lab)]
+        self.assertEqual(measures["k"], 300)
+        self.assertAlmostEqual(measures["min_delta_e"], min(nearest), 6)
+        self.assertAlmostEqual(measures["mean_delta_e"],
+                               sum(nearest) / len(nearest), 6)
+        self.assertEqual(evaluate_palette(list(palette)), measures)
+
+    def test_tune(self):
+        """ tune_spiral() finds a palette at least as good as the default."""
+        cs, measures = tune_spiral(30, budget=0.5, seed=1)
+        self.assertEqual(measures, evaluate_palette(cs.get_colors_array(30)))
+        default = evaluate_palette(get_colors_array(30, jitter=0))
+        self.assertTrue(measures["min_delta_e"] >= default["min_delta_e"])
+        cs, measures = tune_spiral(30, budget=0, seed=1, b=0.33)
+        self.assertEqual(cs.b, 0.33)
+
+    def test_tune_jitter(self):
+        """ With jitter, the measures describe the spiral returned."""
+        for jitter_seed in (None, 5):
+            cs, measures = tune_spiral(30, budget=0, seed=1, jitter=0.2,
+                                       jitter_seed=jitter_seed)
+            self.assertEqual(measures,
+                             evaluate_palette(cs.get_colors_array(30)))
+        self.assertEqual(cs.seed, 5)
+
+
+class SweepTest(unittest.TestCase):
+    """ Generate the palettes of many spirals in one call
+    """
+    def test_sweep(self):
+        """ get_colors_sweep() matches each spiral's get_colors_array()."""
+        a, b = [0.5, 1, 2], [0.2, 0.33, 1.5]
+        sweep = get_colors_sweep(50, a, b, v_final=[0.4, 0.6, 2],
+                                 jitter=0.1, seed=7)
+        self.assertEqual(sweep.shape, (3, 50, 3))
+        for i, v_final in enumerate([0.4, 0.6, 1]):
+            colors = ColorSpiral(a[i], b[i], v_final=v_final, jitter=0.1,
+                                 seed=7).get_colors_array(50)
+            self.assertTrue((sweep[i] == colors).all())
+        self.assertEqual(get_colors_sweep(10, b=[0.33]).shape, (1, 10, 3))
+
+    def test_invalid(self):
+        """ get_colors_sweep() rejects degenerate or mismatched spirals."""
+        self.assertRaises(ValueError, get_colors_sweep, 10, a=[1, 0])
+        self.assertRaises(ValueError, get_colors_sweep, 10, a=[1, 2],
+                          b=[0.1, 0.2, 0.3])
+
+
+def colour_to_lab(colour):
+    """ Convert an sRGB colour to CIELAB (D65), one value at a time"""
+    linear = [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+              for c in colour]
+    matrix = ((0.4124564, 0.3575761, 0.1804375),
+              (0.2126729, 0.7151522, 0.0721750),
+              (0.0193339, 0.1191920, 0.9503041))
+    white = (0.95047, 1.0, 1.08883)
+    xyz = [sum(m * c for m, c in zip(row, linear)) / w
+           for row, w in zip(matrix, white)]
+    f = [t ** (1 / 3.) if t > (6 / 29.) ** 3 else t / (3 * (6 / 29.) ** 2) +
+         4 / 29. for t in xyz]
+    return (116 * f[1] - 16, 500 * (f[0] - f[1]), 200 * (f[1] - f[2]))
+
+
+class RenderTest(unittest.TestCase):
+    """ Render palettes straight to raster images
+    """
+    def setUp(self):
+        """ Make a directory for image files"""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """ Remove image files"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_swatches(self):
+        """ render_swatches() fills one cell per colour, in rows."""
+        palette = get_palette(10, jitter=0)
+        rgb8 = list(palette.to_rgb8())
+        pixels = render_swatches(palette, columns=4, cell=3)
+        self.assertEqual(pixels.shape, (9, 12, 3))
+        for i in range(12):
+            row, column = divmod(i, 4)
+            expected = rgb8[i] if i < 10 else (255, 255, 255)
+            self.assertEqual(tuple(pixels[3 * row + 2, 3 * column]),
+                             expected)
+        self.assertEqual(render_swatches(list(palette)).tolist(),
+                         render_swatches(palette).tolist())
+
+    def test_spiral(self):
+        """ render_spiral() draws each colour on the HSV disc."""
+        colours = [(1.0, 0.0, 0.0), (0.5, 0.5, 0.5), (0.0, 0.0, 1.0)]
+        pixels = render_spiral(colours, size=101, radius=1)
+        # Saturated red at angle 0, grey at the centre, blue at 240 deg
+        self.assertEqual(tuple(pixels[50, 95]), (255, 0, 0))
+        self.assertEqual(tuple(pixels[50, 50]), (128, 128, 128))
+        self.assertEqual(tuple(pixels[89, 27]), (0, 0, 255))
+        self.assertEqual(tuple(pixels[0, 0]), (255, 255, 255))
+
+    def test_save(self):
+        """ save_image() writes PPM, PNG and PDF files."""
+        pixels = render_swatches(get_palette(30, jitter=0), cell=2)
+        height, width = pixels.shape[:2]
+        filename = os.path.join(self.tmpdir, "swatches")
+        save_image(filename + ".ppm", pixels)
+        with open(filename + ".ppm", "rb") as handle:
+            data = handle.read()
+        header = b"P6\n%d %d\n255\n" % (width, height)
+        self.assertEqual(data, header + pixels.tobytes())
+        save_image(filename + ".png", pixels)
+        with open(filename + ".png", "rb") as handle:
+            data = handle.read()
+        self.assertEqual(data[:8], b"\x89PNG\r\n\x1a\n")
+        idat = data.index(b"IDAT")
+        length = int.from_bytes(data[idat - 4:idat], "big")
+        rows = zlib.decompress(data[idat + 4:idat + 4 + length])
+        self.assertEqual(rows, b"".join(b"\x00" + row.tobytes()
+                                        for row in pixels))
+        save_image(filename + ".pdf", pixels)
+        with open(filename + ".pdf", "rb") as handle:
+            self.assertEqual(handle.read(8), b"%PDF-1.4")
+        self.assertRaises(ValueError, save_image, filename + ".gif", pixels)
+
+
+class SpecTest(unittest.TestCase):
+    """ Describe spirals with immutable, hashable SpiralSpec values
+    """
+    def test_value(self):
+        """ SpiralSpec is clamped once, and compares and hashes by value."""
+        spec = SpiralSpec(a=-1, v_init=2, jitter=0.1, seed=3)
+        self.assertEqual(spec, (0, 0.33, 1, 0.5, 0.1, 3))
+        self.assertEqual(spec, SpiralSpec(0, 0.33, 1, 0.5, 0.1, 3))
+        self.assertEqual({spec: 1}[SpiralSpec(0, 0.33, 1, 0.5, 0.1, 3)], 1)
+        self.assertEqual(pickle.loads(pickle.dumps(spec)), spec)
+        self.assertRaises(AttributeError, setattr, spec, "a", 2)
+
+    def test_spiral(self):
+        """ SpiralSpec and ColorSpiral convert to each other."""
+        cs = ColorSpiral(a=2, b=0.5, jitter=0.1, seed=3)
+        self.assertEqual(cs.spec, SpiralSpec(a=2, b=0.5, jitter=0.1, seed=3))
+        self.assertEqual(list(cs.spec.spiral().get_colors(20)),
+                         list(cs.get_colors(20)))
+        self.assertIsNone(ColorSpiral().spec.seed)
+        self.assertRaises(AttributeError, setattr, cs, "colour", 1)
+        self.assertTrue(weakref.ref(cs)() is cs)
+
+    def test_cache(self):
+        """ A SpiralSpec shares cached palettes with its ColorSpiral."""
+        cache = PaletteCache()
+        spec = SpiralSpec(jitter=0.1, seed=3)
+        palette = cache.get(spec, 50)
+        self.assertTrue(cache.get(spec.spiral(), 50) is palette)
+        self.assertEqual(cache.info()["hits"], 1)
+        self.assertEqual(list(palette), list(ColorSpiral(
+            jitter=0.1, seed=3).get_colors(50)))
+
+
+class MetricsTest(unittest.TestCase):
+    """ Record counters and timings of palette generation
+    """
+    def test_collect(self):
+        """ Calls, their k buckets and cache use are recorded."""
+        events = []
+        cache = PaletteCache()
+        palette_cache.clear()
+        with collect_metrics(hook=lambda *event: events.append(event)) as m:
+            colours = ColorSpiral(seed=1).get_colors(100)
+            self.assertEqual(m.snapshot()["calls"], {})
+            self.assertEqual(len(list(colours)), 100)
+            get_colors(5, jitter=0)
+            get_colors(5, jitter=0)
+            cache.get(ColorSpiral(jitter=0), 5)
+            get_color_dict(iter("ABC"), stable=True)
+        get_colors(5, jitter=0)
+        calls = m.snapshot()["calls"]
+        self.assertEqual(calls[("ColorSpiral.get_colors", 100)]["count"], 1)
+        self.assertEqual(calls[("get_colors", 10)]["count"], 2)
+        self.assertEqual(calls[("get_color_dict", None)]["count"], 1)
+        stats = calls[("get_colors", 10)]
+        self.assertEqual(sum(stats["histogram"]), 2)
+        self.assertTrue(0 < stats["max"] <= stats["total"])
+        self.assertEqual(m.snapshot()["cache"][10], {"hits": 1, "misses": 2})
+        self.assertIn(("cache_hit", 5, None), events)
+        self.assertEqual(len(events), len([e for e in events
+                                           if e[0].startswith("cache")]) +
+                         sum(stats["count"] for stats in calls.values()))
+
+    def test_enable(self):
+        """ Metrics are only recorded while enabled."""
+        metrics = enable_metrics(Metrics())
+        try:
+            get_colors_array(10)
+        finally:
+            self.assertTrue(disable_metrics() is metrics)
+        get_colors_array(10)
+        calls = metrics.snapshot()["calls"]
+        self.assertEqual(calls[("get_colors_array", 10)]["count"], 1)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {"calls": {}, "cache": {}})
+
+
+class ServerTest(unittest.TestCase):
+    """ Serve palettes over a socket
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def serve(self, requests, connections=1):
+        """ Send each list of requests on its own connection, returning the
+            server and the decoded answers to each list
+        """
+        async def send(address, lines):
+            reader, writer = await open_palette_connection(address)
+            for line in lines:
+                writer.write(line.encode() + b"\n")
+            answers = [json.loads(await asyncio.wait_for(reader.readline(),
+                                                         10))
+                       for _ in lines]
+            writer.close()
+            await writer.wait_closed()
+            return answers
+
+        async def run():
+            server = await PaletteServer(cache=PaletteCache()).start(
+                os.path.join(self.tmpdir, "palette.sock"))
+            try:
+                return server, await asyncio.gather(
+                    *[send(server.address, lines) for lines in requests])
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        return asyncio.run(run())
+
+    def test_answers(self):
+        """ Answers match the module functions, in request order."""
+        requests = [{"id": 1, "k": 5, "params": {"jitter": 0}},
+                    {"k": 3, "fmt": "hex", "params": {"seed": 2}},
+                    {"id": "d", "op": "dict", "keys": ["a", "b"],
+                     "fmt": "rgb8", "params": {"seed": 2}},
+                    {"k": -1}, [], {"op": "colour"}, {"k": 10 ** 10}]
+        lines = [json.dumps(request) for request in requests] + [
+            "}", "[" * 10 ** 5 + "]" * 10 ** 5, json.dumps({"id": 2, "k": 1})]
+        server, (answers,) = self.serve([lines])
+        self.assertEqual(answers[0]["id"], 1)
+        self.assertEqual(answers[0]["colors"],
+                         [list(c) for c in get_colors(5, jitter=0)])
+        self.assertEqual(answers[1]["colors"],
+                         list(get_colors(3, seed=2, fmt="hex")))
+        self.assertEqual(answers[2], {"id": "d", "colors": dict(
+            (key, list(c)) for key, c in
+            get_color_dict("ab", seed=2, fmt="rgb8").items())})
+        for answer in answers[3:-1]:
+            self.assertEqual(list(answer), ["error"])
+        self.assertEqual(server.stats["errors"], 6)
+        # Requests after any failure are still answered
+        self.assertEqual((answers[-1]["id"], len(answers[-1]["colors"])),
+                         (2, 1))
+
+    def test_coalesce(self):
+        """ Concurrent requests for one palette calculate it once."""
+        line = json.dumps({"k": 1000, "fmt": "packed", "params": {"seed": 4}})
+        server, answers = self.serve([[line]] * 5 + [[line, line]])
+        self.assertEqual(len(set(json.dumps(a) for a in answers)), 2)
+        info = server.cache.info()
+        self.assertEqual(info["misses"], 1)
+        self.assertEqual(server.stats["requests"], 7)
+        # Requests arriving after the calculation, but before its answer
+        # is kept, find the palette in the cache instead
+        self.assertEqual(server.stats["coalesced"] + server.stats["warm"] +
+                         info["hits"], 6)
+
+
+class CommandLineTest(unittest.TestCase):
+    """ Export colours from the command line
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmpdir, "colours")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def export(self, *args):
+        """ Return the output of main() run with args, as bytes """
+        self.assertEqual(main(list(args) + ["-o", self.output]), 0)
+        with open(self.output, "rb") as handle:
+            return handle.read()
+
+    def test_formats(self):
+        """ Each format holds the colours of get_colors_array()."""
+        colours = [tuple(c) for c in get_colors_array(10, seed=3).tolist()]
+        args = ("10", "--seed", "3", "--chunk-size", "4", "-f")
+        self.assertEqual(self.export(*args + ("csv",)).decode(),
+                         "".join("%r,%r,%r\n" % c for c in colours))
+        self.assertEqual([json.loads(line) for line in
+                          self.export(*args + ("ndjson",)).splitlines()],
+                         [list(c) for c in colours])
+        self.assertEqual(self.export(*args + ("hex",)).decode().split(),
+                         list(get_colors(10, seed=3, fmt="hex")))
+        self.assertEqual(list(self.export(*args + ("u8",))),
+                         [x for c in get_colors(10, seed=3, fmt="rgb8")
+                          for x in c])
+        self.assertEqual(self.export(*args + ("csv", "-d", "3")).decode(),
+                         "".join("%.3f,%.3f,%.3f\n" % c for c in colours))
+        floats = array.array("f", self.export(*args + ("f32",)))
+        self.assertEqual(list(floats), list(array.array(
+            "f", [x for c in colours for x in c])))
+
+    def test_digits(self):
+        """ Fixed-point values are clamped alike with or without categories.
+        """
+        colours = [(-0.0, 1.0000000000000002, 0.125), (0.5, -1e-17, 1.0)]
+        for fmt in ("csv", "ndjson"):
+            lines = _export_bytes(np.array(colours), fmt, None, 2)
+            categorised = _export_bytes(np.array(colours), fmt, ["x", "y"],
+                                        2)
+            for line, other in zip(lines.splitlines(),
+                                   categorised.splitlines()):
+                self.assertTrue(other.replace(b"]}", b"]").endswith(
+                    line.lstrip(b"[")), (line, other))
+        self.assertEqual(lines, b"[0.00,1.00,0.12]\n[0.50,0.00,1.00]\n")
+
+    def test_categories(self):
+        """ Distinct categories are coloured, in order of appearance."""
+        categories = os.path.join(self.tmpdir, "categories")
+        with open(categories, "w") as handle:
+            handle.write("A\nB,C\nA\n\nD\n")
+        colours = get_colors(3, jitter=0, fmt="hex")
+        self.assertEqual(
+            self.export("-c", categories, "--jitter", "0", "-f", "hex"),
+            ('A,%s\n"B,C",%s\nD,%s\n' % tuple(colours)).encode())
+        with open(os.devnull, "w") as stderr:
+            sys_stderr, sys.stderr = sys.stderr, stderr
+            try:
+                self.assertRaises(SystemExit, main, ["3", "-c", categories])
+                self.assertRaises(SystemExit, main,
+                                  ["5", "-a", "0", "-b", "0"])
+            finally:
+                sys.stderr = sys_stderr
+
+
+class StoreTest(unittest.TestCase):
+    """ Save palettes to files, and load them by memory mapping
+    """
+    def setUp(self):
+        """ Make a directory for palette files"""
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "palette.bin")
+
+    def tearDown(self):
+        """ Remove palette files"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_load(self):
+        """ Palettes are loaded as they were saved."""
+        cs = ColorSpiral(jitter=0.1, seed=2)
+        for typecode in ('d', 'f', 'B'):
+            save_palette(self.filename, cs, 500, typecode=typecode)
+            palette = load_palette(self.filename)
+            self.assertEqual(palette.typecode, typecode)
+            self.assertEqual(palette, cs.get_palette(500, typecode=typecode))
+        self.assertRaises(ValueError, save_palette, self.filename,
+                          ColorSpiral(jitter=0.1), 500)
+
+    def test_open_regenerates(self):
+        """ open_palette() regenerates files with other parameters."""
+        cs = ColorSpiral(jitter=0)
+        palette = open_palette(self.filename, cs, 100)
+        mtime = os.path.getmtime(self.filename)
+        self.assertEqual(open_palette(self.filename, cs, 100), palette)
+        self.assertEqual(os.path.getmtime(self.filename), mtime)
+        cs.a = 2
+        self.assertEqual(open_palette(self.filename, cs, 100),
+                         cs.get_palette(100))
+        with open(self.filename, "wb") as handle:
+            handle.write(b"not a palette")
+        self.assertRaises(ValueError, load_palette, self.filename)
+        self.assertEqual(len(open_palette(self.filename, cs, 100)), 100)
+
+    def test_open_lookup_table(self):
+        """ open_palette() keeps interpolated and exact palettes apart."""
+        cs = ColorSpiral(jitter=0)
+        cs.build_lut(1e-3)
+        self.assertEqual(open_palette(self.filename, cs, 100),
+                         cs.get_palette(100))
+        exact = ColorSpiral(jitter=0)
+        self.assertEqual(open_palette(self.filename, exact, 100),
+                         exact.get_palette(100))
+
+
+class CacheTest(unittest.TestCase):
+    """ Cache palettes generated by the convenience functions
+    """
+    def setUp(self):
+        """ Start from an empty cache"""
+        palette_cache.clear()
+
+    def test_cache_hits(self):
+        """ Repeated get_colors() calls are served from the cache."""
+        colours = list(get_colors(100, jitter=0))
+        self.assertEqual(colours, list(get_colors(100, jitter=0)))
+        get_color_dict(range(100), jitter=0)
+        info = palette_cache.info()
+        self.assertEqual((info["hits"], info["misses"]), (2, 1))
+        self.assertEqual(colours,
+                         list(ColorSpiral(jitter=0).get_colors(100)))
+
+    def test_jitter_cached_only_when_seeded(self):
+        """ Jittered palettes are cached only with an integer seed."""
+        get_colors(100, jitter=0.1)
+        self.assertEqual(len(palette_cache), 0)
+        colours = list(get_colors(100, jitter=0.1, seed=5))
+        self.assertEqual(len(palette_cache), 1)
+        self.assertEqual(colours, list(get_colors(100, jitter=0.1, seed=5)))
+        self.assertEqual(palette_cache.info()["hits"], 1)
+
+    def test_uncached_lazy(self):
+        """ Uncacheable palettes are generated as they are consumed."""
+        colours = get_colors(10**12, jitter=0.1, fmt="hex")
+        self.assertEqual(len(next(colours)), 7)
+        self.assertEqual(palette_cache.info()["misses"], 0)
+        self.assertRaises(ValueError, get_colors, -1, jitter=0.1)
+        self.assertEqual(palette_cache.maxbytes, 2**28)
+
+    def test_eviction(self):
+        """ Least recently used palettes are evicted beyond the bounds."""
+        cache = PaletteCache(maxsize=2)
+        spiral = ColorSpiral(jitter=0)
+        cache.get(spiral, 10)
+        cache.get(spiral, 20)
+        cache.get(spiral, 10)
+        cache.get(spiral, 30)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.info()["evictions"], 1)
+        cache.get(spiral, 10)
+        self.assertEqual(cache.info()["hits"], 2)
+        cache.resize(maxsize=None, maxbytes=1)
+        self.assertEqual(len(cache), 0)
+
+
+class StableTest(unittest.TestCase):
+    """ Open-ended palettes that can be extended without recolouring
+    """
+    def test_prefix_stable(self):
+        """ get_stable_colors() prefixes do not depend on k."""
+        cs = ColorSpiral(jitter=0.1, seed=3)
+        colours = list(cs.get_stable_colors(1001))
+        self.assertEqual(list(cs.get_stable_colors(1000)), colours[:1000])
+        self.assertEqual(list(cs.get_stable_colors(10, 500)),
+                         colours[500:510])
+
+    def test_extend_dict(self):
+        """ get_color_dict() extends a stable dictionary in place."""
+        cdict = get_color_dict(['A', 'B', 'C'], stable=True, jitter=0)
+        before = dict(cdict)
+        result = get_color_dict(['B', 'D', 'E', 'D'], cdict=cdict,
+                                stable=True, jitter=0)
+        self.assertTrue(result is cdict)
+        self.assertEqual(sorted(cdict), ['A', 'B', 'C', 'D', 'E'])
+        for key, colour in before.items():
+            self.assertEqual(cdict[key], colour)
+        self.assertEqual(cdict, get_color_dict('ABCDE', stable=True,
+                                               jitter=0))
+
+
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=2)
     unittest.main(testRunner=runner)